@@ -26,6 +26,16 @@ from nltk.collocations import *
 import re
 import pickle
 import gzip
+import bz2
+import lzma
+import io
+import hashlib
+import glob
+import mmap
+import heapq
+import bisect
+import array
+import tempfile
 import operator
 import sys
 import math
@@ -34,12 +44,19 @@ import csv
 import string
 
 import importlib
+import contextlib
+import functools
+import threading
+import queue
+import concurrent.futures
+from urllib.request import pathname2url
 
 import gensim
 from gensim.models import Word2Vec
 from gensim.models import KeyedVectors
 import numpy
 import collections
+import itertools
 import numpy as np
 
 import time
@@ -53,10 +70,357 @@ try:
     import spacy_udpipe
 except:
     pass
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 import subprocess
 import openpyxl
 from openpyxl import load_workbook
 
+#secondary indexes of the project schema: name -> (table, indexed columns)
+SECONDARY_INDEXES={
+    "indextaggedngram":("tagged_ngrams","ngram"),
+    "indexembeddings_sl":("embeddings_sl","candidate"),
+    "indexembeddings_sl_ref":("embeddings_sl_ref","candidate"),
+    "indexembeddings_tl":("embeddings_tl","candidate"),
+    "index_index_pt":("index_pt","source"),
+    "index_term_candidates":("term_candidates","candidate"),
+    "index_term_candidates_n_frequency":("term_candidates","n, frequency"),
+    "index_reference_terms":("reference_terms","sl_term"),
+    "index_evaluation_terms":("evaluation_terms","sl_term"),
+    "index_ngrams":("ngrams","ngram"),
+    "index_tokens":("tokens","token"),
+}
+
+#secondary indexes needed by the query-heavy stages (stage -> index names)
+STAGE_INDEXES={
+    "case_normalization":["index_term_candidates"],
+    "nest_normalization":["index_term_candidates","index_term_candidates_n_frequency"],
+    "regexp_exclusion":["index_term_candidates"],
+    "association_measures":["index_term_candidates"],
+    "find_translation_reference_terms":["index_reference_terms"],
+    "learn_linguistic_patterns":["indextaggedngram","index_evaluation_terms"],
+    "find_translation_ptable":["index_index_pt"],
+    "update_ngrams":["index_ngrams","index_tokens"],
+}
+
+#schema migrations: (version, description, TBXTools method that upgrades the schema). Version 1 is the original schema.
+MIGRATIONS=[
+    (2,"integer-interned token store","create_token_store_tables"),
+    (3,"secondary indexes of the index manager","create_indexes"),
+    (4,"query planner statistics","analyze"),
+    (5,"shards of the corpora","create_shards_table"),
+    (6,"segment deduplication","create_dedup_columns"),
+    (7,"incremental ngram counts","create_ngram_state_tables"),
+    (8,"checkpoints of the loaders","create_load_checkpoints_table"),
+    (9,"source file of the segments","create_source_file_columns"),
+    (10,"external corpora","create_external_corpora_table"),
+    (11,"token stores of the other language tokenizer","create_other_token_store_tables"),
+]
+
+#tables of the resources cached in memory as frozensets (see get_resource) and the column they hold
+RESOURCE_COLUMNS={"sl_stopwords":"sl_stopword","tl_stopwords":"tl_stopword","sl_inner_stopwords":"sl_inner_stopword","tl_inner_stopwords":"tl_inner_stopword","exclusion_terms":"sl_term","exclusion_noterms":"sl_term","evaluation_terms":"sl_term"}
+
+#ways of counting the ngrams of ngram_calculation
+NGRAM_MODES=["exact","sketch","external","apriori"]
+
+#tables with a content hash for deduplication (see create_dedup_columns)
+DEDUP_TABLES=["sl_corpus","tl_corpus","parallel_corpus"]
+#tables with a multiplicity column
+MULTIPLICITY_TABLES=["sl_corpus","tl_corpus","parallel_corpus","sl_tagged_corpus","tl_tagged_corpus"]
+
+#column holding the segments of each corpus table
+CORPUS_COLUMNS={
+    "sl_corpus":"segment",
+    "tl_corpus":"segment",
+    "sl_corpus_c":"segment",
+    "tl_corpus_c":"segment",
+    "sl_tagged_corpus":"tagged_segment",
+    "tl_tagged_corpus":"tagged_segment",
+    "sl_tagged_corpus_c":"tagged_segment",
+    "tl_tagged_corpus_c":"tagged_segment",
+}
+
+SCHEMA_VERSION=MIGRATIONS[-1][0]
+
+def bulk_loader(method):
+    '''Decorator that runs a loading method inside the bulk_load context of the project.'''
+    @functools.wraps(method)
+    def wrapper(self,*args,**kwargs):
+        with self.bulk_load():
+            return(method(self,*args,**kwargs))
+    return(wrapper)
+
+#buffer size for reading input files
+READ_BUFFER_SIZE=1048576
+
+def input_compression(path):
+    '''Returns the compression of a file ("gzip", "bzip2", "xz" or "zstd"), detected by its magic bytes, or None for uncompressed files.'''
+    with open(path,"rb") as f:
+        magic=f.read(6)
+    if magic.startswith(b"\x1f\x8b"):
+        return("gzip")
+    elif magic.startswith(b"BZh"):
+        return("bzip2")
+    elif magic.startswith(b"\xfd7zXZ\x00"):
+        return("xz")
+    elif magic.startswith(b"\x28\xb5\x2f\xfd"):
+        return("zstd")
+    return(None)
+
+def open_input(path):
+    '''Opens a file for binary reading. Files compressed with gzip, bzip2, xz or zstd (detected by their magic bytes, not by the extension) are decompressed on the fly. Files made of several concatenated frames (as with pzstd or zstd -c a b) are read whole. Zstandard requires the zstandard module.'''
+    compression=input_compression(path)
+    if compression=="gzip":
+        stream=gzip.open(path,"rb")
+    elif compression=="bzip2":
+        stream=bz2.open(path,"rb")
+    elif compression=="xz":
+        stream=lzma.open(path,"rb")
+    elif compression=="zstd":
+        if zstandard==None:
+            raise Exception("The zstandard module is required to read "+path)
+        stream=zstandard.ZstdDecompressor().stream_reader(open(path,"rb",buffering=READ_BUFFER_SIZE),read_across_frames=True,closefd=True)
+    else:
+        return(open(path,"rb",buffering=READ_BUFFER_SIZE))
+    return(io.BufferedReader(stream,buffer_size=READ_BUFFER_SIZE))
+
+def segment_hash(*segments):
+    '''Returns the content hash (16 bytes) of a segment or of a pair of segments, used to deduplicate them.'''
+    return(hashlib.blake2b("\x00".join(segments).encode("utf-8"),digest_size=16).digest())
+
+def open_text(path,encoding="utf-8",errors="strict"):
+    '''Opens a text file, compressed or not (see open_input), for reading.'''
+    return(io.TextIOWrapper(open_input(path),encoding=encoding,errors=errors))
+
+#TMX inline elements holding native codes, not text: their content is skipped (but not their tails)
+TMX_CODE_ELEMENTS=["bpt","ept","ph","it","ut"]
+
+def tmx_segment_text(seg):
+    '''Returns the text of a TMX seg element, including the text inside inline markup (like hi) but not the native codes of the elements in TMX_CODE_ELEMENTS.'''
+    parts=[]
+    if seg.text:
+        parts.append(seg.text)
+    for child in seg:
+        if not child.tag in TMX_CODE_ELEMENTS:
+            parts.append(tmx_segment_text(child))
+        if child.tail:
+            parts.append(child.tail)
+    return("".join(parts))
+
+def iter_tmx_pairs(tmx_file,slcodes,tlcodes):
+    '''Yields the (source segment, target segment) pairs of the translation units of a TMX file (compressed or not) having both languages. Every tu is released once it is read, so the memory used doesn't depend on the size of the file.'''
+    entrada=open_input(tmx_file)
+    try:
+        ancestors=[]
+        for event, elem in etree.iterparse(entrada,events=("start","end")):
+            if event=="start":
+                ancestors.append(elem)
+                continue
+            ancestors.pop()
+            if not elem.tag=="tu":
+                continue
+            sl_segment=""
+            tl_segment=""
+            for tuv in elem.iter("tuv"):
+                lang=tuv.get("{http://www.w3.org/XML/1998/namespace}lang",tuv.get("lang",""))
+                seg=tuv.find("seg")
+                if seg==None:
+                    continue
+                if lang in slcodes:
+                    sl_segment=tmx_segment_text(seg)
+                if lang in tlcodes:
+                    tl_segment=tmx_segment_text(seg)
+            if not sl_segment=="" and not tl_segment=="":
+                yield(sl_segment,tl_segment)
+            elem.clear()
+            if len(ancestors)>0:
+                ancestors[-1].remove(elem)
+    finally:
+        entrada.close()
+
+#TBX elements of the concept entries (TBX v3 and TBX 2008) and of their language sections
+TBX_CONCEPT_ELEMENTS=["conceptEntry","termEntry"]
+TBX_LANGUAGE_ELEMENTS=["langSec","langSet"]
+
+def iter_tbx_concepts(tbx_file):
+    '''Yields the terms of every concept entry of a TBX file (compressed or not) as a list of (language code, term), in the order of the file. Every entry is released once it is read, so the memory used doesn't depend on the size of the file.'''
+    entrada=open_input(tbx_file)
+    try:
+        ancestors=[]
+        lang=""
+        terms=[]
+        for event, elem in etree.iterparse(entrada,events=("start","end")):
+            tag=elem.tag.split("}")[-1]
+            if event=="start":
+                ancestors.append(elem)
+                if tag in TBX_LANGUAGE_ELEMENTS:
+                    lang=elem.get("{http://www.w3.org/XML/1998/namespace}lang",elem.get("lang",""))
+                continue
+            ancestors.pop()
+            if tag=="term":
+                terms.append((lang,"".join(elem.itertext()).strip()))
+            elif tag in TBX_LANGUAGE_ELEMENTS:
+                lang=""
+            elif tag in TBX_CONCEPT_ELEMENTS:
+                if len(terms)>0:
+                    yield(terms)
+                terms=[]
+                elem.clear()
+                if len(ancestors)>0:
+                    ancestors[-1].remove(elem)
+    finally:
+        entrada.close()
+
+class Compoundifier:
+    '''Aho-Corasick automaton over a list of multiword terms. It rewrites a text in a single pass joining the words of every occurrence of a term with comp_symbol (leftmost-longest, non-overlapping matches). Terms without spaces are ignored, as compoundifying them doesn't change the text.'''
+    def __init__(self,terms,comp_symbol="▁"):
+        self.comp_symbol=comp_symbol
+        self.goto=[{}]
+        self.fail=[0]
+        self.lengths=[0] #length of the longest term ending in each state (0 if none)
+        self.output=[0] #nearest state in the failure chain (itself included) where a term ends
+        self.terms=0
+        for term in terms:
+            if term==None or term.find(" ")==-1:
+                continue
+            state=0
+            for char in term:
+                following=self.goto[state].get(char)
+                if following==None:
+                    following=len(self.goto)
+                    self.goto[state][char]=following
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.lengths.append(0)
+                    self.output.append(0)
+                state=following
+            if self.lengths[state]==0:
+                self.terms+=1
+            self.lengths[state]=len(term)
+        #failure and output links, in breadth-first order
+        states=collections.deque(self.goto[0].values())
+        while len(states)>0:
+            state=states.popleft()
+            if self.lengths[state]>0:
+                self.output[state]=state
+            else:
+                self.output[state]=self.output[self.fail[state]]
+            for char,following in self.goto[state].items():
+                fallback=self.fail[state]
+                while fallback>0 and not char in self.goto[fallback]:
+                    fallback=self.fail[fallback]
+                if char in self.goto[fallback] and not self.goto[fallback][char]==following:
+                    self.fail[following]=self.goto[fallback][char]
+                else:
+                    self.fail[following]=0
+                states.append(following)
+    
+    def find(self,text):
+        '''Returns the list of (start, end) positions of the leftmost-longest non-overlapping occurrences of the terms in text.'''
+        goto=self.goto
+        fail=self.fail
+        lengths=self.lengths
+        output=self.output
+        longest={} #start -> end of the longest term starting there
+        state=0
+        for position in range(len(text)):
+            char=text[position]
+            while state>0 and not char in goto[state]:
+                state=fail[state]
+            state=goto[state].get(char,0)
+            match=output[state]
+            while match>0:
+                start=position+1-lengths[match]
+                if longest.get(start,-1)<position+1:
+                    longest[start]=position+1
+                match=output[fail[match]]
+        matches=[]
+        last_end=0
+        for start in sorted(longest):
+            if start>=last_end:
+                matches.append((start,longest[start]))
+                last_end=longest[start]
+        return(matches)
+    
+    def compoundify(self,text):
+        '''Returns the text with the words of every term occurrence joined with comp_symbol.'''
+        if self.terms==0:
+            return(text)
+        matches=self.find(text)
+        if len(matches)==0:
+            return(text)
+        parts=[]
+        last_end=0
+        for start,end in matches:
+            parts.append(text[last_end:start])
+            parts.append(text[start:end].replace(" ",self.comp_symbol))
+            last_end=end
+        parts.append(text[last_end:])
+        return("".join(parts))
+
+#bytes of the file scanned at a time when indexing an external corpus
+INDEX_CHUNK_SIZE=67108864
+#segments of an external corpus whose offsets are converted at a time when iterating over it
+ITER_CHUNK_SEGMENTS=65536
+
+def index_lines(path):
+    '''Returns the index of the lines of an uncompressed text file used by the external corpora: the length in bytes of every line (line feed included) as a packed array of uint32.'''
+    size=os.path.getsize(path)
+    if size==0:
+        return(b"")
+    ends=[]
+    with open(path,"rb") as f:
+        with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as m:
+            for start in range(0,size,INDEX_CHUNK_SIZE):
+                chunk=np.frombuffer(m,dtype=np.uint8,count=min(INDEX_CHUNK_SIZE,size-start),offset=start)
+                ends.append(np.flatnonzero(chunk==10)+start+1)
+                #the mmap can't be closed while an array points to it
+                del chunk
+    ends=np.concatenate(ends)
+    if len(ends)==0 or ends[-1]<size:
+        #last line without line feed
+        ends=np.append(ends,size)
+    lengths=np.diff(ends,prepend=0)
+    if lengths.max()>=2**32:
+        raise Exception("Lines longer than 4 GB can't be indexed")
+    return(lengths.astype("<u4").tobytes())
+
+class ExternalCorpus:
+    '''Read-only access through mmap to the segments of an external corpus (an uncompressed file with one segment per line), given the index of its lines (see index_lines). The id of a segment is its line number, starting at 1.'''
+    def __init__(self,path,line_lengths,encoding="utf-8"):
+        self.path=path
+        self.encoding=encoding
+        lengths=np.frombuffer(line_lengths,dtype="<u4")
+        self.segments=len(lengths)
+        self.offsets=np.zeros(self.segments+1,dtype=np.uint64)
+        np.cumsum(lengths,dtype=np.uint64,out=self.offsets[1:])
+        self.file=open(path,"rb")
+        self.map=None
+        if self.segments>0:
+            self.map=mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+    
+    def segment(self,id):
+        '''Returns the segment with the given id, or None if there is no such segment.'''
+        if id<1 or id>self.segments:
+            return(None)
+        return(self.map[int(self.offsets[id-1]):int(self.offsets[id])].decode(self.encoding,errors="ignore").rstrip())
+    
+    def iter_segments(self,min_id=0):
+        '''Yields (id, segment) for every segment with an id greater than min_id.'''
+        for first in range(max(min_id,0),self.segments,ITER_CHUNK_SEGMENTS):
+            last=min(first+ITER_CHUNK_SEGMENTS,self.segments)
+            offsets=self.offsets[first:last+1].tolist()
+            for i in range(last-first):
+                yield((first+i+1,self.map[offsets[i]:offsets[i+1]].decode(self.encoding,errors="ignore").rstrip()))
+    
+    def close(self):
+        '''Closes the mmap and the file.'''
+        if not self.map==None:
+            self.map.close()
+        self.file.close()
+
 class TBXTools:
     '''Class for automatic terminology extraction and terminology management.'''
     def __init__(self):
@@ -100,22 +464,60 @@ class TBXTools:
         
         self.SLtokenizer=None
         self.TLtokenizer=None
+        self.SLtokenizer_name=""
+        self.TLtokenizer_name=""
+        
+        #the token stores are updated by the corpus loaders (see build_token_store)
+        self.token_store_on_load=True
+        self.vocabulary=None
+        self.vocabulary_ids=None
+        
+        self.conn=None
+        #SQLite performance profile applied to every project connection (see set_pragmas)
+        self.pragmas={"journal_mode":"WAL","synchronous":"NORMAL","cache_size":-262144,"mmap_size":1073741824,"temp_store":"MEMORY"}
+        #synchronous mode used while a bulk load is running (see bulk_load). NORMAL in WAL mode can lose the last transactions on a power loss or OS crash, but never corrupts the database, so the load checkpoints stay consistent with the segments. With OFF a crash during a bulk load can corrupt the project, which then needs a fresh load.
+        self.bulk_synchronous="NORMAL"
+        self.bulk_load_depth=0
+        #stages whose indexes have been checked since the last drop_indexes
+        self.indexed_stages=set()
+        
+        #read-only connections, one per thread (see get_reader)
+        self.project_name=None
+        self.in_memory=False
+        self.memory_uri=None
+        self.writer_thread=None
+        self.readers=threading.local()
+        self.reader_connections=[]
+        self.readers_lock=threading.Lock()
+        
+        #ingestion pipeline (see run_ingestion_pipeline)
+        self.pipeline_queue_size=8 #maximum number of batches waiting for the writer
+        self.max_transaction_rows=200000 #rows written by the writer thread before committing
         
+        #compoundify automata built from the compoundify terms tables (see get_compoundifier)
+        self.compoundifiers={}
         
+        #external corpora opened in this session (see get_external_corpus)
+        self.external_corpora={}
         
+        #stopwords and term lists cached in memory (see get_resource)
+        self.resources={}
         
-    def create_project(self,project_name,sllang=None, tllang=None,overwrite=False):
-        '''Opens a project. If the project already exists, it raises an exception. To avoid the exception use overwrite=True. To open existing projects, use the open_project method.'''
+        
+        
+    def create_project(self,project_name,sllang=None, tllang=None,overwrite=False,in_memory=False):
+        '''Opens a project. If the project already exists, it raises an exception. To avoid the exception use overwrite=True. To open existing projects, use the open_project method.
+        With in_memory=True the project is created in memory and no file is written until the snapshot method is called (project_name is then the default path of the snapshot).'''
         #sllang and tllang are not longer used.
         if os.path.isfile(project_name) and not overwrite:
                 raise Exception("This file already exists")
         
         else:
-            if os.path.isfile(project_name) and overwrite:
-                os.remove(project_name)
-            self.conn=sqlite3.connect(project_name)
-            self.cur = self.conn.cursor() 
-            self.cur2 = self.conn.cursor()
+            if os.path.isfile(project_name) and overwrite and not in_memory:
+                for suffix in ["","-wal","-shm"]:
+                    if os.path.isfile(project_name+suffix):
+                        os.remove(project_name+suffix)
+            self.connect(project_name,in_memory=in_memory)
             with self.conn:
                 self.cur = self.conn.cursor()
                 self.cur.execute("CREATE TABLE sl_corpus(id INTEGER PRIMARY KEY AUTOINCREMENT, segment TEXT)")
@@ -149,33 +551,674 @@ class TBXTools:
                 self.cur.execute("CREATE TABLE ngrams (id INTEGER PRIMARY KEY AUTOINCREMENT, ngram TEXT, n INTEGER, frequency INTEGER)")
                 self.cur.execute("CREATE TABLE tagged_ngrams (id INTEGER PRIMARY KEY AUTOINCREMENT, ngram TEXT, tagged_ngram TEXT, n INTEGER, frequency INTEGER)")
                 
-                self.cur.execute("CREATE INDEX indextaggedngram on tagged_ngrams (ngram);")
-                
                 self.cur.execute("CREATE TABLE embeddings_sl (id INTEGER PRIMARY KEY AUTOINCREMENT, candidate TEXT, embedding BLOB)")
-                self.cur.execute("CREATE INDEX indexembeddings_sl on embeddings_sl (candidate);")
                 
                 self.cur.execute("CREATE TABLE embeddings_sl_ref (id INTEGER PRIMARY KEY AUTOINCREMENT, candidate TEXT, embedding BLOB)")
-                self.cur.execute("CREATE INDEX indexembeddings_sl_ref on embeddings_sl_ref (candidate);")
                 
                 self.cur.execute("CREATE TABLE embeddings_tl (id INTEGER PRIMARY KEY AUTOINCREMENT, candidate TEXT, embedding BLOB)")
-                self.cur.execute("CREATE INDEX indexembeddings_tl on embeddings_tl (candidate);")
                 
                 self.cur.execute("CREATE TABLE term_candidates (id INTEGER PRIMARY KEY AUTOINCREMENT, candidate TEXT, n INTEGER, frequency INTEGER, measure TEXT, value FLOAT)")
                 self.cur.execute("CREATE TABLE index_pt(id INTEGER PRIMARY KEY AUTOINCREMENT, source TEXT, target TEXT, probability FLOAT)")
-                self.cur.execute("CREATE INDEX index_index_pt on index_pt (source);")
                 self.cur.execute("CREATE TABLE linguistic_patterns (id INTEGER PRIMARY KEY AUTOINCREMENT, linguistic_pattern TEXT)")
+                self.cur.execute("CREATE TABLE schema_version (version INTEGER)")
+                self.cur.execute("INSERT INTO schema_version (version) VALUES (1)")
                 
                 self.conn.commit()
+            self.migrate()
                 
-    def open_project(self,project_name):
-        '''Opens an existing project. If the project doesn't exist it raises an exception.'''
+    def open_project(self,project_name,load_into_memory=False):
+        '''Opens an existing project. If the project doesn't exist it raises an exception.
+        With load_into_memory=True the project is copied into memory, which speeds up read-heavy sessions. Changes are not written to the file unless the snapshot method is called.'''
         if not os.path.isfile(project_name):
                 raise Exception("Project not found")
         else:
-            self.conn=sqlite3.connect(project_name)
-            self.cur = self.conn.cursor() 
-            self.cur2 = self.conn.cursor()
+            self.connect(project_name,in_memory=load_into_memory)
+            if load_into_memory:
+                source=sqlite3.connect(project_name)
+                source.backup(self.conn)
+                source.close()
+                self.apply_pragmas()
+            self.migrate()
+    
+    def connect(self,project_name,in_memory=False):
+        '''Opens the writer connection of the project, either to the file project_name or to a new in-memory database.'''
+        self.close_readers()
+        self.in_memory=in_memory
+        if in_memory:
+            #a named shared-cache database, so the read-only connections of other threads can reach it
+            self.memory_uri="file:tbxtools-"+str(id(self))+"-"+str(time.time_ns())+"?mode=memory&cache=shared"
+            self.conn=sqlite3.connect(self.memory_uri,uri=True,check_same_thread=False)
+        else:
+            #the connection is handed over to the writer thread of the ingestion pipeline (see run_ingestion_pipeline)
+            self.conn=sqlite3.connect(project_name,check_same_thread=False)
+        self.project_name=project_name
+        self.writer_thread=threading.get_ident()
+        self.apply_pragmas()
+        self.vocabulary=None
+        self.vocabulary_ids=None
+        self.indexed_stages=set()
+        self.resources={}
+        self.close_external_corpora()
+        self.cur = self.conn.cursor() 
+        self.cur2 = self.conn.cursor()
+    
+    def snapshot(self,path=None):
+        '''Writes a copy of the project database to path (by default the project name) with the SQLite online backup API. This is the way to persist projects created with in_memory=True or opened with load_into_memory=True, but it can be used with any project.'''
+        if path==None:
+            path=self.project_name
+        self.conn.commit()
+        destination=sqlite3.connect(path)
+        try:
+            self.conn.backup(destination)
+        finally:
+            destination.close()
+    
+    def apply_pragmas(self):
+        '''Applies the SQLite performance profile stored in self.pragmas to the project connection.'''
+        self.conn.commit()
+        for pragma in self.pragmas:
+            self.conn.execute("PRAGMA "+pragma+"="+str(self.pragmas[pragma]))
+    
+    def set_pragmas(self,**pragmas):
+        '''Changes the SQLite performance profile (for example set_pragmas(cache_size=-1048576, mmap_size=0)) and applies it to the open project, if any.'''
+        self.pragmas.update(pragmas)
+        if not self.conn==None:
+            self.apply_pragmas()
+    
+    @contextlib.contextmanager
+    def bulk_load(self):
+        '''Context for bulk ingestion. The synchronous mode is relaxed to self.bulk_synchronous while the load is running and the durability of the profile is restored (and the WAL checkpointed) when it finishes. Nested contexts are allowed.'''
+        self.bulk_load_depth+=1
+        if self.bulk_load_depth==1:
+            self.conn.commit()
+            self.conn.execute("PRAGMA synchronous="+str(self.bulk_synchronous))
+        completed=False
+        try:
+            yield self
+            completed=True
+        finally:
+            self.bulk_load_depth-=1
+            if self.bulk_load_depth==0:
+                if completed: self.conn.commit()
+                self.conn.execute("PRAGMA synchronous="+str(self.pragmas.get("synchronous","FULL")))
+                if str(self.conn.execute("PRAGMA journal_mode").fetchone()[0]).lower()=="wal":
+                    self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    #INGESTION PIPELINE
+    
+    def run_ingestion_pipeline(self,batches,verbose=False):
+        '''Writes the batches produced by a generator with a dedicated writer thread, so reading and transforming the input (in the calling thread) overlaps with the SQLite writes. Every batch is a list of (sql, rows) statements for the same segments; the writer commits every self.max_transaction_rows rows. The project connection must not be used by other threads until the pipeline finishes. Returns a dictionary with the throughput of the load.'''
+        batches_queue=queue.Queue(maxsize=self.pipeline_queue_size)
+        stats={"segments":0,"rows":0,"batches":0,"transactions":0,"read_seconds":0.0,"write_seconds":0.0}
+        errors=[]
+        writer=threading.Thread(target=self.ingestion_writer,args=(batches_queue,stats,errors),name="TBXTools-writer")
+        start=time.perf_counter()
+        self.conn.commit()
+        writer.start()
+        try:
+            batches=iter(batches)
+            while len(errors)==0:
+                t=time.perf_counter()
+                batch=next(batches,None)
+                stats["read_seconds"]+=time.perf_counter()-t
+                if batch==None:
+                    break
+                batches_queue.put(batch)
+        finally:
+            batches_queue.put(None)
+            writer.join()
+        if len(errors)>0:
+            raise errors[0]
+        stats["seconds"]=time.perf_counter()-start
+        if stats["seconds"]>0:
+            stats["segments_per_second"]=stats["segments"]/stats["seconds"]
+        else:
+            stats["segments_per_second"]=0.0
+        if verbose:
+            print("Loaded",stats["segments"],"segments in",round(stats["seconds"],2),"seconds ("+str(round(stats["segments_per_second"]))+" segments/s, reading",round(stats["read_seconds"],2),"s, writing",round(stats["write_seconds"],2),"s)")
+        return(stats)
+    
+    def ingestion_writer(self,batches_queue,stats,errors):
+        '''Body of the writer thread of run_ingestion_pipeline. On error the transaction is rolled back and the queue is drained until the end mark.'''
+        pending=0
+        try:
+            while True:
+                batch=batches_queue.get()
+                if batch==None:
+                    break
+                t=time.perf_counter()
+                for sql,rows in batch:
+                    self.conn.executemany(sql,rows)
+                    pending+=len(rows)
+                    stats["rows"]+=len(rows)
+                if len(batch)>0:
+                    stats["segments"]+=len(batch[0][1])
+                stats["batches"]+=1
+                if pending>=self.max_transaction_rows:
+                    self.conn.commit()
+                    stats["transactions"]+=1
+                    pending=0
+                stats["write_seconds"]+=time.perf_counter()-t
+            t=time.perf_counter()
+            self.conn.commit()
+            stats["transactions"]+=1
+            stats["write_seconds"]+=time.perf_counter()-t
+        except BaseException as e:
+            errors.append(e)
+            self.conn.rollback()
+            while not batches_queue.get()==None:
+                pass
+    
+    def get_compoundifier(self,side="sl",comp_symbol="▁"):
+        '''Returns the Compoundifier of the compoundify terms of the source (side="sl") or target (side="tl") language. The automaton is built once and rebuilt only when the compoundify terms table changes.'''
+        table="compoundify_terms_"+side
+        signature=self.conn.execute("SELECT count(*), max(id) FROM "+table).fetchone()
+        key=(side,comp_symbol)
+        if not key in self.compoundifiers or not self.compoundifiers[key][0]==signature:
+            compterms=[]
+            for d in self.conn.execute("SELECT term FROM "+table):
+                compterms.append(d[0])
+            self.compoundifiers[key]=(signature,Compoundifier(compterms,comp_symbol))
+        return(self.compoundifiers[key][1])
+    
+    def monolingual_corpus_batches(self,corpusfile,table,encoding="utf-8",compoundifier=None,dedup=False,checkpoint=None):
+        '''Reads a monolingual corpus (one segment per line) and yields batches of self.maxinserts segments for run_ingestion_pipeline, compoundifying the segments with the given Compoundifier, if any. With dedup a segment already in the table increases its multiplicity instead of being inserted again. The checkpoint (loader, source, position) skips the first position lines and records the load checkpoint with every batch (nothing is read if position is None).'''
+        self.check_not_external(table)
+        if not checkpoint==None and checkpoint[2]==None:
+            return
+        cf=open_text(corpusfile,encoding=encoding,errors="ignore")
+        position=0
+        if not checkpoint==None:
+            while position<checkpoint[2] and cf.readline():
+                position+=1
+        if dedup:
+            sql="INSERT INTO "+table+" (segment, hash) VALUES (?,?) ON CONFLICT(hash) DO UPDATE SET multiplicity=multiplicity+1"
+        else:
+            sql="INSERT INTO "+table+" (segment) VALUES (?)"
+        data=[]
+        for line in cf:
+            line=line.rstrip()
+            if not compoundifier==None:
+                line=compoundifier.compoundify(line)
+            if dedup:
+                data.append([line,segment_hash(line)])
+            else:
+                data.append([line])
+            position+=1
+            if len(data)==self.maxinserts:
+                yield(self.checkpointed_batch([(sql,data)],checkpoint,position,table))
+                data=[]
+        cf.close()
+        if len(data)>0:
+            yield(self.checkpointed_batch([(sql,data)],checkpoint,position,table))
+    
+    def parallel_corpus_batches(self,pairs,feed_monolingual=True,reverse=False,dedup=False,checkpoint=None):
+        '''Yields batches of self.maxinserts segment pairs for run_ingestion_pipeline from an iterator of (source segment, target segment) pairs, for the parallel corpus and (with feed_monolingual) the monolingual corpora. With dedup a pair already loaded increases its multiplicity instead of being inserted again. The hash of the pair is used for the three tables, so their ids stay aligned. The checkpoint (loader, source, position) skips the first position pairs and records the load checkpoint with every batch (nothing is read if position is None).'''
+        if feed_monolingual:
+            self.check_not_external("sl_corpus")
+            self.check_not_external("tl_corpus")
+        if not checkpoint==None and checkpoint[2]==None:
+            return
+        parallel_data=[]
+        sl_data=[]
+        tl_data=[]
+        position=0
+        for sl_segment,tl_segment in pairs:
+            position+=1
+            if not checkpoint==None and position<=checkpoint[2]:
+                continue
+            if reverse:
+                sl_segment,tl_segment=tl_segment,sl_segment
+            if dedup:
+                pair_hash=segment_hash(sl_segment,tl_segment)
+                parallel_data.append([sl_segment,tl_segment,pair_hash])
+                sl_data.append([sl_segment,pair_hash])
+                tl_data.append([tl_segment,pair_hash])
+            else:
+                parallel_data.append([sl_segment,tl_segment])
+                sl_data.append([sl_segment])
+                tl_data.append([tl_segment])
+            if len(parallel_data)==self.maxinserts:
+                yield(self.checkpointed_batch(self.parallel_corpus_batch(parallel_data,sl_data,tl_data,feed_monolingual,dedup),checkpoint,position,"parallel_corpus"))
+                parallel_data=[]
+                sl_data=[]
+                tl_data=[]
+        if len(parallel_data)>0:
+            yield(self.checkpointed_batch(self.parallel_corpus_batch(parallel_data,sl_data,tl_data,feed_monolingual,dedup),checkpoint,position,"parallel_corpus"))
+    
+    def parallel_corpus_batch(self,parallel_data,sl_data,tl_data,feed_monolingual=True,dedup=False):
+        '''Returns the statements of a batch of parallel_corpus_batches.'''
+        if dedup:
+            upsert=" ON CONFLICT(hash) DO UPDATE SET multiplicity=multiplicity+1"
+            batch=[("INSERT INTO parallel_corpus (segmentSL, segmentTL, hash) VALUES (?,?,?)"+upsert,parallel_data)]
+            if feed_monolingual:
+                batch.append(("INSERT INTO sl_corpus (segment, hash) VALUES (?,?)"+upsert,sl_data))
+                batch.append(("INSERT INTO tl_corpus (segment, hash) VALUES (?,?)"+upsert,tl_data))
+        else:
+            batch=[("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",parallel_data)]
+            if feed_monolingual:
+                batch.append(("INSERT INTO sl_corpus (segment) VALUES (?)",sl_data))
+                batch.append(("INSERT INTO tl_corpus (segment) VALUES (?)",tl_data))
+        return(batch)
+    
+    #LOAD CHECKPOINTS
+    
+    def create_load_checkpoints_table(self):
+        '''Creates the table of the checkpoints of the loaders (if it doesn't exist yet).'''
+        self.conn.execute("CREATE TABLE IF NOT EXISTS load_checkpoints (loader TEXT, source TEXT, position INTEGER, last_id INTEGER, finished INTEGER, PRIMARY KEY (loader, source))")
+        self.conn.commit()
+    
+    def resume_position(self,loader,source,resume=False):
+        '''Returns the position (lines or translation units already loaded) from which a loader has to continue loading source: the position of the last checkpoint if resume is True, or 0 (resetting the checkpoint) otherwise. Returns None if resume is True and the load was finished.'''
+        if resume:
+            row=self.conn.execute("SELECT position, finished FROM load_checkpoints WHERE loader=? AND source=?",(loader,source)).fetchone()
+            if not row==None:
+                if row[1]:
+                    return(None)
+                return(row[0])
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO load_checkpoints (loader, source, position, last_id, finished) VALUES (?,?,0,NULL,0)",(loader,source))
+        return(0)
+    
+    def checkpointed_batch(self,batch,checkpoint,position,table):
+        '''Adds to a batch of the ingestion pipeline the statement recording the checkpoint of the load, so it is committed in the same transaction as the segments.'''
+        if not checkpoint==None:
+            batch.append(("UPDATE load_checkpoints SET position=?, last_id=(SELECT max(id) FROM "+table+") WHERE loader=? AND source=?",[[position,checkpoint[0],checkpoint[1]]]))
+        return(batch)
+    
+    def finish_checkpoint(self,loader,source):
+        '''Marks the load of source as finished.'''
+        with self.conn:
+            self.conn.execute("UPDATE load_checkpoints SET finished=1 WHERE loader=? AND source=?",(loader,source))
+    
+    def show_load_checkpoints(self):
+        '''Shows the checkpoints of the loads: loader, source, position, last id loaded and whether the load was finished.'''
+        for s in self.conn.execute("SELECT loader, source, position, last_id, finished FROM load_checkpoints ORDER BY loader, source"):
+            print(s[0]+"\t"+s[1]+"\t"+str(s[2])+"\t"+str(s[3])+"\t"+str(bool(s[4])))
+    
+    def delete_load_checkpoints(self):
+        '''Deletes the checkpoints of the loads.'''
+        with self.conn:
+            self.conn.execute("DELETE FROM load_checkpoints")
+    
+    #EXTERNAL CORPORA
+    
+    def create_external_corpora_table(self):
+        '''Creates the table of the external corpora (if it doesn't exist yet): the path of the file of sl_corpus or tl_corpus, its size and modification time when it was indexed and the index of its lines (see index_lines).'''
+        self.conn.execute("CREATE TABLE IF NOT EXISTS external_corpora (corpus TEXT PRIMARY KEY, path TEXT, encoding TEXT, size INTEGER, mtime REAL, segments INTEGER, line_lengths BLOB)")
+        self.conn.commit()
+    
+    def load_sl_corpus_external(self,corpusfile,encoding="utf-8"):
+        '''Uses an uncompressed file (one segment per line) as the source language corpus without copying it into the project, which only stores its path and an index of its lines. The segments are read through mmap by ngram_calculation, the embeddings and the translation finders. The corpus is read-only (it can't be compoundified or extended) and the file must not change. Returns the number of segments.'''
+        return(self.load_external_corpus("sl_corpus",corpusfile,encoding))
+    
+    def load_tl_corpus_external(self,corpusfile,encoding="utf-8"):
+        '''Uses an uncompressed file (one segment per line) as the target language corpus without copying it into the project (see load_sl_corpus_external).'''
+        return(self.load_external_corpus("tl_corpus",corpusfile,encoding))
+    
+    def load_external_corpus(self,corpus,corpusfile,encoding="utf-8"):
+        '''Common part of load_sl_corpus_external and load_tl_corpus_external.'''
+        if not input_compression(corpusfile)==None:
+            raise Exception("External corpora can't be compressed")
+        if self.conn.execute("SELECT count(*) FROM "+corpus).fetchone()[0]>0:
+            raise Exception("The corpus "+corpus+" is not empty. Delete it before using an external corpus.")
+        path=os.path.abspath(corpusfile)
+        line_lengths=index_lines(path)
+        segments=len(line_lengths)//4
+        self.close_external_corpora()
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO external_corpora (corpus, path, encoding, size, mtime, segments, line_lengths) VALUES (?,?,?,?,?,?,?)",(corpus,path,encoding,os.path.getsize(path),os.path.getmtime(path),segments,line_lengths))
+            for store in self.token_stores_of(corpus):
+                self.conn.execute("DELETE FROM "+store)
+        self.invalidate_counts(corpus)
+        return(segments)
+    
+    def get_external_corpus(self,corpus):
+        '''Returns the ExternalCorpus of sl_corpus or tl_corpus, or None if the corpus is stored in the project. It raises an exception if the file has changed since it was indexed.'''
+        row=self.conn.execute("SELECT path, encoding, size, mtime FROM external_corpora WHERE corpus=?",(corpus,)).fetchone()
+        if row==None:
+            return(None)
+        path,encoding,size,mtime=row
+        if not os.path.isfile(path) or not os.path.getsize(path)==size or not os.path.getmtime(path)==mtime:
+            raise Exception("The file of the external corpus "+corpus+" ("+path+") has changed. Load it again.")
+        if not corpus in self.external_corpora or not self.external_corpora[corpus][0]==row:
+            line_lengths=self.conn.execute("SELECT line_lengths FROM external_corpora WHERE corpus=?",(corpus,)).fetchone()[0]
+            if corpus in self.external_corpora:
+                self.external_corpora[corpus][1].close()
+            self.external_corpora[corpus]=(row,ExternalCorpus(path,line_lengths,encoding))
+        return(self.external_corpora[corpus][1])
+    
+    def close_external_corpora(self):
+        '''Closes the external corpora opened in this session.'''
+        for corpus in self.external_corpora:
+            self.external_corpora[corpus][1].close()
+        self.external_corpora={}
+    
+    def delete_external_corpus(self,corpus):
+        '''Stops using an external corpus as sl_corpus or tl_corpus (the file is not deleted).'''
+        self.close_external_corpora()
+        with self.conn:
+            self.conn.execute("DELETE FROM external_corpora WHERE corpus=?",(corpus,))
+    
+    def check_not_external(self,corpus):
+        '''Raises an exception if the corpus is an external corpus, which is read-only.'''
+        if self.conn.execute("SELECT corpus FROM external_corpora WHERE corpus=?",(corpus,)).fetchone():
+            raise Exception("The corpus "+corpus+" is an external corpus and can't be modified")
+    
+    def iter_segments(self,corpus="sl_corpus",min_id=0):
+        '''Yields (id, segment) for every segment of sl_corpus or tl_corpus with an id greater than min_id, either from the project or from the external corpus.'''
+        external=self.get_external_corpus(corpus)
+        if not external==None:
+            for s in external.iter_segments(min_id):
+                yield(s)
+        else:
+            cur=self.conn.cursor()
+            cur.execute("SELECT id, segment FROM "+corpus+" WHERE id>? ORDER BY id",(min_id,))
+            for s in cur:
+                yield(s)
+    
+    def corpus_last_id(self,corpus):
+        '''Returns the greatest id of the segments of a corpus (0 if it is empty), either in the project or in the external corpus.'''
+        if corpus in ["sl_corpus","tl_corpus"]:
+            external=self.get_external_corpus(corpus)
+            if not external==None:
+                return(external.segments)
+        return(self.conn.execute("SELECT coalesce(max(id),0) FROM "+corpus).fetchone()[0])
+    
+    #DIRECTORY INGESTION
+    
+    def create_source_file_columns(self):
+        '''Adds the file each segment was loaded from to the corpus tables (NULL for the segments not loaded with the directory loaders).'''
+        for table in ["sl_corpus","tl_corpus","parallel_corpus"]:
+            columns=[]
+            for c in self.conn.execute("PRAGMA table_info("+table+")"):
+                columns.append(c[1])
+            if not "source_file" in columns:
+                self.conn.execute("ALTER TABLE "+table+" ADD COLUMN source_file TEXT")
+        self.conn.commit()
+    
+    def corpus_dir_files(self,path,pattern):
+        '''Returns the sorted list of files in the directory path matching the glob pattern (** matches subdirectories).'''
+        files=[]
+        for f in sorted(glob.glob(os.path.join(path,pattern),recursive=True)):
+            if os.path.isfile(f):
+                files.append(f)
+        return(files)
+    
+    def next_segment_id(self,tables):
+        '''Returns the id the next segment inserted in any of the tables would get (the same for all of them).'''
+        next_id=1
+        for table in tables:
+            row=self.conn.execute("SELECT max(coalesce((SELECT max(id) FROM "+table+"),0),coalesce((SELECT seq FROM sqlite_sequence WHERE name=?),0))",(table,)).fetchone()
+            next_id=max(next_id,row[0]+1)
+        return(next_id)
+    
+    def corpus_file_batches(self,results,tables,dedup=False,pretokenized=False):
+        '''Yields the batches for run_ingestion_pipeline of the files preprocessed by the workers of the directory loaders. results yields (file, rows, tokens): rows are the segments of the file (a tuple per segment with one segment for every table but parallel_corpus, that takes the pair) and tokens their lists of tokens (a tuple per segment with a list for every monolingual table) or None. With pretokenized the segments get consecutive ids and are added to the token stores too.'''
+        statements=[]
+        for table in tables:
+            if not table=="parallel_corpus":
+                self.check_not_external(table)
+            if table=="parallel_corpus":
+                columns=["segmentSL","segmentTL","source_file"]
+            else:
+                columns=["segment","source_file"]
+            if pretokenized:
+                columns=["id"]+columns
+            if dedup:
+                columns.append("hash")
+            sql="INSERT INTO "+table+" ("+", ".join(columns)+") VALUES ("+",".join(["?"]*len(columns))+")"
+            if dedup:
+                sql+=" ON CONFLICT(hash) DO UPDATE SET multiplicity=multiplicity+1"
+            statements.append(sql)
+        monolingual=[]
+        for table in tables:
+            if not table=="parallel_corpus":
+                monolingual.append(table)
+        if pretokenized:
+            next_id=self.next_segment_id(tables)
+        for source_file,rows,tokens in results:
+            for start in range(0,len(rows),self.maxinserts):
+                data=[]
+                for table in tables:
+                    data.append([])
+                newtokens=[]
+                stores=[]
+                for table in monolingual:
+                    stores.append([])
+                for i in range(start,min(start+self.maxinserts,len(rows))):
+                    row=rows[i]
+                    prefix=[]
+                    if pretokenized:
+                        prefix=[next_id]
+                        for k in range(len(monolingual)):
+                            stores[k].append((next_id,self.pack_tokens(tokens[i][k],newtokens)))
+                        next_id+=1
+                    suffix=[]
+                    if dedup:
+                        suffix=[segment_hash(*row)]
+                    k=0
+                    for t in range(len(tables)):
+                        if tables[t]=="parallel_corpus":
+                            data[t].append(prefix+list(row)+[source_file]+suffix)
+                        else:
+                            data[t].append(prefix+[row[k]]+[source_file]+suffix)
+                            k+=1
+                batch=[]
+                for t in range(len(tables)):
+                    batch.append((statements[t],data[t]))
+                if pretokenized:
+                    batch.append(("INSERT INTO vocabulary (id, token) VALUES (?,?)",newtokens))
+                    for k in range(len(monolingual)):
+                        batch.append(("INSERT INTO "+monolingual[k]+"_tokens (id, token_ids) VALUES (?,?)",stores[k]))
+                yield(batch)
+    
+    def load_corpus_dir(self,tasks,worker,tables,workers=None,compoundifier=None,pretokenized=False,dedup=False,verbose=False):
+        '''Common part of the directory loaders: the files of the tasks are read, compoundified and tokenized (if pretokenized) by the worker function in a pool of workers processes and written by the writer thread of the ingestion pipeline, in the order of the tasks.'''
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers,initializer=init_corpus_worker,initargs=(compoundifier,)) as executor:
+                stats=self.run_ingestion_pipeline(self.corpus_file_batches(bounded_map(executor,worker,tasks),tables,dedup,pretokenized),verbose)
+        except:
+            #the vocabulary in memory may hold tokens that were not stored
+            self.vocabulary=None
+            self.vocabulary_ids=None
+            raise
+        stats["files"]=len(tasks)
+        return(stats)
+    
+    @bulk_loader
+    def load_sl_corpus_dir(self,path,pattern="*.txt",workers=None,encoding="utf-8",compoundify=False,comp_symbol="▁",verbose=False,dedup=False):
+        '''Loads all the files of a directory matching the glob pattern (one segment per line, compressed or not) into the source language corpus, recording the file of every segment. The files are read, compoundified and tokenized in parallel by a pool of workers processes (by default, one per CPU) and written by a single writer, in the order of the file names. Returns the statistics of the load (see run_ingestion_pipeline).'''
+        return(self.load_monolingual_corpus_dir("sl",path,pattern,workers,encoding,compoundify,comp_symbol,verbose,dedup))
+    
+    @bulk_loader
+    def load_tl_corpus_dir(self,path,pattern="*.txt",workers=None,encoding="utf-8",compoundify=False,comp_symbol="▁",verbose=False,dedup=False):
+        '''Loads all the files of a directory matching the glob pattern into the target language corpus (see load_sl_corpus_dir).'''
+        return(self.load_monolingual_corpus_dir("tl",path,pattern,workers,encoding,compoundify,comp_symbol,verbose,dedup))
+    
+    def load_monolingual_corpus_dir(self,side,path,pattern,workers,encoding,compoundify,comp_symbol,verbose,dedup):
+        '''Common part of load_sl_corpus_dir (side="sl") and load_tl_corpus_dir (side="tl").'''
+        corpus=side+"_corpus"
+        compoundifier=None
+        if compoundify:
+            compoundifier=self.get_compoundifier(side,comp_symbol)
+        #with dedup the ids of the segments are not known in advance, so the token store is built afterwards
+        tokenizers=None
+        if self.token_store_on_load and not dedup:
+            self.build_token_store(corpus)
+            tokenizers=(self.get_tokenizer(side)[0],)
+        tasks=[]
+        for f in self.corpus_dir_files(path,pattern):
+            tasks.append((f,encoding,tokenizers))
+        stats=self.load_corpus_dir(tasks,read_monolingual_file,[corpus],workers,compoundifier,not tokenizers==None,dedup,verbose)
+        if self.token_store_on_load:
+            self.build_token_store(corpus)
+        return(stats)
+    
+    @bulk_loader
+    def load_parallel_corpus_dir(self,path,pattern="*.tmx",sl_code="",tl_code="",format="tmx",workers=None,feed_monolingual=True,encoding="utf-8",verbose=False,dedup=False):
+        '''Loads all the parallel files of a directory matching the glob pattern, recording the file of every segment. The format can be "tmx" (sl_code and tl_code are needed, see load_parallel_corpus_tmx) or "tabtxt" (see load_parallel_corpus_tabtxt). The files are parsed and tokenized in parallel by a pool of workers processes (by default, one per CPU) and written by a single writer, in the order of the file names. Returns the statistics of the load (see run_ingestion_pipeline).'''
+        if not format in ["tmx","tabtxt"]:
+            raise Exception("Format must be tmx or tabtxt")
+        tables=["parallel_corpus"]
+        if feed_monolingual:
+            tables.extend(["sl_corpus","tl_corpus"])
+        tokenizers=None
+        if feed_monolingual and self.token_store_on_load and not dedup:
+            self.build_token_store("sl_corpus")
+            self.build_token_store("tl_corpus")
+            tokenizers=(self.get_tokenizer("sl")[0],self.get_tokenizer("tl")[0])
+        slcodes=[]
+        for slc in sl_code.split(","):
+            slcodes.append(slc.strip())
+        tlcodes=[]
+        for tlc in tl_code.split(","):
+            tlcodes.append(tlc.strip())
+        tasks=[]
+        for f in self.corpus_dir_files(path,pattern):
+            tasks.append((f,format,encoding,slcodes,tlcodes,tokenizers))
+        stats=self.load_corpus_dir(tasks,read_parallel_file,tables,workers,None,not tokenizers==None,dedup,verbose)
+        if feed_monolingual and self.token_store_on_load:
+            self.build_token_store("sl_corpus")
+            self.build_token_store("tl_corpus")
+        return(stats)
+    
+    #DEDUPLICATION
+    
+    def create_dedup_columns(self):
+        '''Adds the content hash (with a unique index) and the multiplicity of the segments to the corpus tables. Rows loaded without dedup have no hash and multiplicity 1. The existing shards are deleted, as the shard files of earlier versions don't hold the multiplicities.'''
+        for table in MULTIPLICITY_TABLES:
+            columns=[]
+            for c in self.conn.execute("PRAGMA table_info("+table+")"):
+                columns.append(c[1])
+            if table in DEDUP_TABLES and not "hash" in columns:
+                self.conn.execute("ALTER TABLE "+table+" ADD COLUMN hash BLOB")
+            if not "multiplicity" in columns:
+                self.conn.execute("ALTER TABLE "+table+" ADD COLUMN multiplicity INTEGER NOT NULL DEFAULT 1")
+            if table in DEDUP_TABLES:
+                self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS index_"+table+"_hash ON "+table+" (hash)")
+        self.conn.commit()
+        self.delete_shards()
+    
+    def copy_multiplicities(self,corpus,tagged_corpus):
+        '''Copies the multiplicities of the segments of a corpus to the tagged corpus produced from it by a tagger (they share the ids).'''
+        with self.conn:
+            self.conn.execute("UPDATE "+tagged_corpus+" SET multiplicity=(SELECT multiplicity FROM "+corpus+" WHERE "+corpus+".id="+tagged_corpus+".id) WHERE id IN (SELECT id FROM "+corpus+" WHERE multiplicity>1)")
+    
+    def get_multiplicities(self,corpus="sl_corpus"):
+        '''Returns a dictionary id -> multiplicity with the segments of the corpus loaded more than once in dedup mode.'''
+        multiplicities={}
+        for s in self.conn.execute("SELECT id, multiplicity FROM "+corpus+" WHERE multiplicity>1"):
+            multiplicities[s[0]]=s[1]
+        return(multiplicities)
             
+    #SCHEMA VERSIONS
+    
+    def get_schema_version(self):
+        '''Returns the schema version of the project (1 for projects created before the schema was versioned).'''
+        if self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'").fetchone()==None:
+            return(1)
+        return(self.conn.execute("SELECT max(version) FROM schema_version").fetchone()[0])
+    
+    def migrate(self,verbose=False):
+        '''Upgrades the schema of the project in place to SCHEMA_VERSION applying the pending MIGRATIONS. No data is reloaded. It is called by create_project and open_project.'''
+        version=self.get_schema_version()
+        for migration in MIGRATIONS:
+            if migration[0]>version:
+                if verbose:
+                    print("Migrating project to schema version",migration[0],"("+migration[1]+")")
+                getattr(self,migration[2])()
+                with self.conn:
+                    self.conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)")
+                    self.conn.execute("DELETE FROM schema_version")
+                    self.conn.execute("INSERT INTO schema_version (version) VALUES (?)",(migration[0],))
+                version=migration[0]
+        return(version)
+    
+    def analyze(self):
+        '''Gathers the statistics used by the SQLite query planner (sqlite_stat tables).'''
+        self.conn.commit()
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+    
+    #READ-ONLY CONNECTIONS
+    
+    def get_reader(self):
+        '''Returns the read-only connection (URI mode=ro) of the current thread, opening it the first time. The writer connection (self.conn) stays with the thread that created or opened the project, so several threads can query the project at the same time, even while a load is running. For in-memory projects the connection shares the cache of the writer and is set to query_only.'''
+        conn=getattr(self.readers,"conn",None)
+        if conn==None:
+            if self.in_memory:
+                conn=sqlite3.connect(self.memory_uri,uri=True,check_same_thread=False)
+                conn.execute("PRAGMA query_only=ON")
+            else:
+                conn=sqlite3.connect("file:"+pathname2url(os.path.abspath(self.project_name))+"?mode=ro",uri=True,check_same_thread=False)
+            for pragma in ["cache_size","mmap_size","temp_store"]:
+                if pragma in self.pragmas:
+                    conn.execute("PRAGMA "+pragma+"="+str(self.pragmas[pragma]))
+            self.readers.conn=conn
+            with self.readers_lock:
+                self.reader_connections.append(conn)
+        return(conn)
+    
+    def close_readers(self):
+        '''Closes the read-only connections of all the threads.'''
+        with self.readers_lock:
+            for conn in self.reader_connections:
+                conn.close()
+            self.reader_connections=[]
+            self.readers=threading.local()
+    
+    def is_writer_thread(self):
+        '''Returns True if the current thread is the one owning the writer connection.'''
+        return(threading.get_ident()==self.writer_thread)
+    
+    #INDEX MANAGER
+    
+    def get_indexes(self):
+        '''Returns a list of (index name, table, indexed columns) with the secondary indexes that currently exist in the project.'''
+        indexes=[]
+        for s in self.conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL ORDER BY tbl_name, name"):
+            columns=[]
+            for c in self.conn.execute("PRAGMA index_info("+s[0]+")"):
+                columns.append(c[2])
+            indexes.append((s[0],s[1],", ".join(columns)))
+        return(indexes)
+    
+    def show_indexes(self):
+        '''Shows the secondary indexes of the project and the registered indexes that are missing.'''
+        existing=[]
+        for index in self.get_indexes():
+            existing.append(index[0])
+            print(index[0]+"\t"+index[1]+"\t"+index[2])
+        for name in SECONDARY_INDEXES:
+            if not name in existing:
+                print(name+"\t"+SECONDARY_INDEXES[name][0]+"\t"+SECONDARY_INDEXES[name][1]+"\t(missing)")
+    
+    def drop_indexes(self,tables=None):
+        '''Drops the secondary indexes of the given tables (all the tables if None), usually before a bulk load. They are rebuilt by create_indexes.'''
+        with self.conn:
+            for name in SECONDARY_INDEXES:
+                if tables==None or SECONDARY_INDEXES[name][0] in tables:
+                    self.conn.execute("DROP INDEX IF EXISTS "+name)
+        self.indexed_stages=set()
+    
+    def create_indexes(self,stage=None):
+        '''Creates the missing secondary indexes needed by a query-heavy stage (see STAGE_INDEXES) or all the secondary indexes if no stage is given. Methods called from worker threads don't create indexes, so call it before sharing the project with them.'''
+        if not stage==None and stage in self.indexed_stages:
+            return
+        if stage==None:
+            names=list(SECONDARY_INDEXES)
+        else:
+            names=STAGE_INDEXES.get(stage,[])
+        existing=[]
+        for index in self.get_indexes():
+            existing.append(index[0])
+        with self.conn:
+            for name in names:
+                if not name in existing:
+                    self.conn.execute("CREATE INDEX IF NOT EXISTS "+name+" ON "+SECONDARY_INDEXES[name][0]+" ("+SECONDARY_INDEXES[name][1]+")")
+        if not stage==None:
+            self.indexed_stages.add(stage)
 
     #METODES DELETES
     def delete_configuration(self):
@@ -188,13 +1231,21 @@ class TBXTools:
         '''Deletes de source language corpus.'''
         with self.conn:
             self.cur.execute('DELETE FROM sl_corpus')
+            for store in self.token_stores_of("sl_corpus"):
+                self.cur.execute('DELETE FROM '+store)
             self.conn.commit()
+        self.delete_external_corpus("sl_corpus")
+        self.invalidate_counts("sl_corpus")
     
     def delete_tl_corpus(self):
         '''Deletes de target language corpus.'''
         with self.conn:
             self.cur.execute('DELETE FROM tl_corpus')
+            for store in self.token_stores_of("tl_corpus"):
+                self.cur.execute('DELETE FROM '+store)
             self.conn.commit()
+        self.delete_external_corpus("tl_corpus")
+        self.invalidate_counts("tl_corpus")
             
     def delete_parallel_corpus(self):
         '''Deletes de target language corpus.'''
@@ -219,6 +1270,7 @@ class TBXTools:
         with self.conn:
             self.cur.execute('DELETE FROM sl_tagged_corpus')
             self.conn.commit()
+        self.invalidate_counts("sl_tagged_corpus")
     
     def delete_tl_tagged_corpus(self):
         '''Deletes the target language tagged corpus.'''
@@ -240,6 +1292,7 @@ class TBXTools:
     
     def delete_sl_stopwords(self):
         '''Deletes the stop-words for the source language.'''
+        self.invalidate_resources("sl_stopwords")
         #self.sl_stopwords=[]
         with self.conn:
             self.cur.execute('DELETE FROM sl_stopwords')
@@ -247,6 +1300,7 @@ class TBXTools:
             
     def delete_tl_stopwords(self):
         '''Deletes the stop-words fot the target language.'''
+        self.invalidate_resources("tl_stopwords")
         #self.tl_stopwords=[]
         with self.conn:
             self.cur.execute('DELETE FROM tl_stopwords')
@@ -254,6 +1308,7 @@ class TBXTools:
             
     def delete_sl_inner_stopwords(self):
         '''Deletes the inner stop-words for the source language.'''
+        self.invalidate_resources("sl_inner_stopwords")
         #self.sl_inner_stopwords=[]
         with self.conn:
             self.cur.execute('DELETE FROM sl_inner_stopwords')
@@ -261,6 +1316,7 @@ class TBXTools:
             
     def delete_tl_inner_stopwords(self):
         '''Deletes the innter stop-words for the target language.'''
+        self.invalidate_resources("tl_inner_stopwords")
         #self.tl_inner_stopwords=[]
         with self.conn:
             self.cur.execute('DELETE FROM tl_inner_stopwords')
@@ -296,6 +1352,7 @@ class TBXTools:
 
     def delete_evaluation_terms(self):
         '''Deletes the evaluation terms.'''
+        self.invalidate_resources("evaluation_terms")
         #self.evaluation_terms={}
         with self.conn:
             self.cur.execute('DELETE FROM evaluation_terms')
@@ -326,7 +1383,7 @@ class TBXTools:
         '''Deletes the compoundify terms for the target language.'''
         #self.exclusion_terms={}
         with self.conn:
-            self.cur.execute('DELETE FROM compoundify_terms_sl')
+            self.cur.execute('DELETE FROM compoundify_terms_tl')
             self.conn.commit()
     
     def delete_tsr_terms(self):
@@ -338,6 +1395,7 @@ class TBXTools:
     
     def delete_exclusion_terms(self):
         '''Deletes the exclusion terms.'''
+        self.invalidate_resources("exclusion_terms")
         #self.exclusion_terms={}
         with self.conn:
             self.cur.execute('DELETE FROM exclusion_terms')
@@ -345,9 +1403,10 @@ class TBXTools:
     
     def delete_exclusion_no_terms(self):
         '''Deletes the exclusion no terms.'''
+        self.invalidate_resources("exclusion_noterms")
         #self.exclusion_terms={}
         with self.conn:
-            self.cur.execute('DELETE FROM exclusion_no_terms')
+            self.cur.execute('DELETE FROM exclusion_noterms')
             self.conn.commit() 
             
     def delete_tokens(self):
@@ -358,10 +1417,13 @@ class TBXTools:
             self.conn.commit()
             
     def delete_ngrams(self):
-        '''Deletes the ngrams.'''
+        '''Deletes the ngrams (and the state of the incremental counts, see update_ngrams).'''
         #self.ngrams={}
         with self.conn:
             self.cur.execute('DELETE FROM ngrams')
+            self.cur.execute('DELETE FROM ngram_state')
+            self.cur.execute('DELETE FROM pending_ngrams')
+            self.cur.execute('DELETE FROM counted_multiplicities')
             self.conn.commit()
             
     def delete_tagged_ngrams(self):
@@ -399,348 +1461,147 @@ class TBXTools:
             self.cur.execute('DELETE FROM linguistic_patterns')
             self.conn.commit() 
                      
-    def load_sl_corpus(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁"):
-        '''Loads a monolingual corpus for the source language. It's recommended, but not compulsory, that the corpus is segmented (one segment per line). Use external tools to segment the corpus. A plain text corpus (not segmented), can be aslo used.'''
+    @bulk_loader
+    def load_sl_corpus(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁", verbose=False, dedup=False, resume=False):
+        '''Loads a monolingual corpus for the source language. It's recommended, but not compulsory, that the corpus is segmented (one segment per line). Use external tools to segment the corpus. A plain text corpus (not segmented), can be aslo used. With dedup=True repeated segments are stored once with their multiplicity. With resume=True an interrupted load of the same file continues from its last checkpoint.'''
+        compoundifier=None
         if compoundify:
-            compterms=[]
-            self.cur.execute('SELECT term from compoundify_terms_sl')
-            data=self.cur.fetchall()
-            for d in data:
-                compterms.append(d[0])            
-        cf=codecs.open(corpusfile,"r",encoding=encoding,errors="ignore")
-        data=[]
-        continserts=0
-        for line in cf:            
-            record=[]
-            line=line.rstrip()
-            if compoundify:
-                for compterm in compterms:
-                    if line.find(compterm)>=1:
-                        comptermMOD=compterm.replace(" ",comp_symbol)
-                        line=line.replace(compterm,comptermMOD)
-            record.append(line)
-            data.append(record)
-            continserts+=1
-            if continserts==self.maxinserts:
-                self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",data)
-                data=[]
-                continserts=0
-        with self.conn:
-            self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",data)    
-        self.conn.commit()
-        
-    def load_tl_corpus(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁"):
-        '''Loads a monolingual corpus for the target language. It's recommended, but not compulsory, that the corpus is segmented (one segment per line). Use TBXTools external tools to segment the corpus. A plain text corpus (not segmented), can be aslo used.'''
+            compoundifier=self.get_compoundifier("sl",comp_symbol)
+        source=os.path.abspath(corpusfile)
+        position=self.resume_position("load_sl_corpus",source,resume)
+        stats=self.run_ingestion_pipeline(self.monolingual_corpus_batches(corpusfile,"sl_corpus",encoding,compoundifier,dedup,("load_sl_corpus",source,position)),verbose)
+        self.finish_checkpoint("load_sl_corpus",source)
+        if self.token_store_on_load:
+            self.build_token_store("sl_corpus")
+        return(stats)
         
+    @bulk_loader
+    def load_tl_corpus(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁", verbose=False, dedup=False, resume=False):
+        '''Loads a monolingual corpus for the target language. It's recommended, but not compulsory, that the corpus is segmented (one segment per line). Use TBXTools external tools to segment the corpus. A plain text corpus (not segmented), can be aslo used. With dedup=True repeated segments are stored once with their multiplicity. With resume=True an interrupted load of the same file continues from its last checkpoint.'''
+        compoundifier=None
         if compoundify:
-            compterms=[]
-            self.cur.execute('SELECT term from compoundify_terms_tl')
-            data=self.cur.fetchall()
-            for d in data:
-                compterms.append(d[0])            
-        cf=codecs.open(corpusfile,"r",encoding=encoding,errors="ignore")
-        data=[]
-        continserts=0
-        for line in cf:            
-            record=[]
-            line=line.rstrip()
-            if compoundify:
-                for compterm in compterms:
-                    if line.find(compterm)>=1:
-                        comptermMOD=compterm.replace(" ",comp_symbol)
-                        line=line.replace(compterm,comptermMOD)
-            record.append(line)
-            data.append(record)
-            continserts+=1
-            if continserts==self.maxinserts:
-                self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",data)
-                data=[]
-                continserts=0
-        with self.conn:
-            self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",data)    
-        self.conn.commit()        
-    
-    def load_sl_corpus_c(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁"):
+            compoundifier=self.get_compoundifier("tl",comp_symbol)
+        source=os.path.abspath(corpusfile)
+        position=self.resume_position("load_tl_corpus",source,resume)
+        stats=self.run_ingestion_pipeline(self.monolingual_corpus_batches(corpusfile,"tl_corpus",encoding,compoundifier,dedup,("load_tl_corpus",source,position)),verbose)
+        self.finish_checkpoint("load_tl_corpus",source)
+        if self.token_store_on_load:
+            self.build_token_store("tl_corpus")
+        return(stats)
+        
+    @bulk_loader
+    def load_sl_corpus_c(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁", verbose=False):
         '''Loads a monolingual contrast corpus for the source language. It's recommended, but not compulsory, that the corpus is segmented (one segment per line). Use external tools to segment the corpus. A plain text corpus (not segmented), can be aslo used.'''
+        compoundifier=None
         if compoundify:
-            compterms=[]
-            self.cur.execute('SELECT term from compoundify_terms_sl')
-            data=self.cur.fetchall()
-            for d in data:
-                compterms.append(d[0])            
-        cf=codecs.open(corpusfile,"r",encoding=encoding,errors="ignore")
-        data=[]
-        continserts=0
-        for line in cf:            
-            record=[]
-            line=line.rstrip()
-            if compoundify:
-                for compterm in compterms:
-                    if line.find(compterm)>=1:
-                        comptermMOD=compterm.replace(" ",comp_symbol)
-                        line=line.replace(compterm,comptermMOD)
-            record.append(line)
-            data.append(record)
-            continserts+=1
-            if continserts==self.maxinserts:
-                cur.executemany("INSERT INTO sl_corpus_c (segment) VALUES (?)",data)
-                data=[]
-                continserts=0
-        with self.conn:
-            self.cur.executemany("INSERT INTO sl_corpus_c (segment) VALUES (?)",data)    
-        self.conn.commit()
+            compoundifier=self.get_compoundifier("sl",comp_symbol)
+        stats=self.run_ingestion_pipeline(self.monolingual_corpus_batches(corpusfile,"sl_corpus_c",encoding,compoundifier),verbose)
+        return(stats)
         
-    def load_tl_corpus_c(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁"):
+    @bulk_loader
+    def load_tl_corpus_c(self,corpusfile, encoding="utf-8", compoundify=False, comp_symbol="▁", verbose=False):
         '''Loads a monolingual contrast corpus for the target language. It's recommended, but not compulsory, that the corpus is segmented (one segment per line). Use TBXTools external tools to segment the corpus. A plain text corpus (not segmented), can be aslo used.'''
-        
+        compoundifier=None
         if compoundify:
-            compterms=[]
-            self.cur.execute('SELECT term from compoundify_terms_tl')
-            data=self.cur.fetchall()
-            for d in data:
-                compterms.append(d[0])            
-        cf=codecs.open(corpusfile,"r",encoding=encoding,errors="ignore")
-        data=[]
-        continserts=0
-        for line in cf:            
-            record=[]
-            line=line.rstrip()
-            if compoundify:
-                for compterm in compterms:
-                    if line.find(compterm)>=1:
-                        comptermMOD=compterm.replace(" ",comp_symbol)
-                        line=line.replace(compterm,comptermMOD)
-            record.append(line)
-            data.append(record)
-            continserts+=1
-            if continserts==self.maxinserts:
-                cur.executemany("INSERT INTO tl_corpus_c (segment) VALUES (?)",data)
-                data=[]
-                continserts=0
-        with self.conn:
-            self.cur.executemany("INSERT INTO tl_corpus_c (segment) VALUES (?)",data)    
-        self.conn.commit() 
+            compoundifier=self.get_compoundifier("tl",comp_symbol)
+        stats=self.run_ingestion_pipeline(self.monolingual_corpus_batches(corpusfile,"tl_corpus_c",encoding,compoundifier),verbose)
+        return(stats)
         
-    def load_parallel_corpus_Moses(self,slcorpusfile, tlcorpusfile, feed_monolingual=True, encoding="utf-8"):
-        '''Loads a parallel corpus in Moses format (that is, in two independent files). It expects one segment per line.'''
-        slcf=codecs.open(slcorpusfile,"r",encoding=encoding)
-        tlcf=codecs.open(tlcorpusfile,"r",encoding=encoding)
-        parallel_data=[]
-        sl_data=[]
-        tl_data=[]
-        parallel_data=[]
-        continserts=0
-        while 1:
-            sl_segment=slcf.readline()
-            if not sl_segment:
-                break
-            tl_segment=tlcf.readline()
-            continserts+=1            
-            sl_record=[]
-            tl_record=[]
-            parallel_record=[]
-            sl_segment=sl_segment.rstrip()
-            tl_segment=tl_segment.rstrip()
-            parallel_record.append(sl_segment)
-            parallel_record.append(tl_segment)
-            sl_record.append(sl_segment)
-            tl_record.append(tl_segment)
-            parallel_data.append(parallel_record)
-            sl_data.append(sl_record)
-            tl_data.append(tl_record)
-            if continserts==self.maxinserts:
-                self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",parallel_data)
-                if feed_monolingual:
-                    self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",sl_data)
-                    self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",tl_data)
-                parallel_data=[]    
-                sl_data=[]
-                tl_data=[]
-                continserts=0
-        with self.conn:
-            self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",parallel_data)
-            if feed_monolingual:
-                self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",sl_data)
-                self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",tl_data) 
-        self.conn.commit()
+    @bulk_loader
+    def load_parallel_corpus_Moses(self,slcorpusfile, tlcorpusfile, feed_monolingual=True, encoding="utf-8", verbose=False, dedup=False, resume=False):
+        '''Loads a parallel corpus in Moses format (that is, in two independent files). It expects one segment per line. With resume=True an interrupted load of the same files continues from its last checkpoint.'''
+        slcf=open_text(slcorpusfile,encoding=encoding)
+        tlcf=open_text(tlcorpusfile,encoding=encoding)
+        def pairs():
+            while 1:
+                sl_segment=slcf.readline()
+                if not sl_segment:
+                    break
+                tl_segment=tlcf.readline()
+                yield(sl_segment.rstrip(),tl_segment.rstrip())
+        source=os.path.abspath(slcorpusfile)+"\t"+os.path.abspath(tlcorpusfile)
+        position=self.resume_position("load_parallel_corpus_Moses",source,resume)
+        stats=self.run_ingestion_pipeline(self.parallel_corpus_batches(pairs(),feed_monolingual,dedup=dedup,checkpoint=("load_parallel_corpus_Moses",source,position)),verbose)
+        self.finish_checkpoint("load_parallel_corpus_Moses",source)
+        slcf.close()
+        tlcf.close()
+        if feed_monolingual and self.token_store_on_load:
+            self.build_token_store("sl_corpus")
+            self.build_token_store("tl_corpus")
+        return(stats)
         
-    def load_parallel_corpus_tabtxt(self,corpusfile, feed_monolingual=True, reverse=False, encoding="utf-8"):
-        '''Loads a parallel corpus in tabbed text format (that is, in two independent files). It expects one segment per line.'''
-        cf=codecs.open(corpusfile,"r",encoding=encoding)        
-        parallel_data=[]
-        sl_data=[]
-        tl_data=[]
-        parallel_data=[]
-        parallel_data_rev=[]
-        continserts=0
-        for linia in cf:
-            linia=linia.rstrip()
-            camps=linia.split("\t")
-            if len(camps)>=2:
-                sl_segment=camps[0]
-                tl_segment=camps[1]
-                continserts+=1            
-                sl_record=[]
-                tl_record=[]
-                parallel_record=[]
-                parallel_record_rev=[]
-                sl_segment=sl_segment.rstrip()
-                tl_segment=tl_segment.rstrip()
-                parallel_record.append(sl_segment)
-                parallel_record.append(tl_segment)
-                parallel_record_rev.append(tl_segment)
-                parallel_record_rev.append(sl_segment)
-                sl_record.append(sl_segment)
-                tl_record.append(tl_segment)
-                parallel_data.append(parallel_record)
-                parallel_data_rev.append(parallel_record_rev)
-                sl_data.append(sl_record)
-                tl_data.append(tl_record)
-            if continserts==self.maxinserts:
-                if reverse:
-                    self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",parallel_data_rev)
-                else:
-                    self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",parallel_data)
-                if feed_monolingual:
-                    if reverse:
-                        self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",tl_data)
-                        self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",sl_data)
-                    else:
-                        self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",sl_data)
-                        self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",tl_data)
-                parallel_data=[]
-                parallel_data_rev=[]                
-                sl_data=[]
-                tl_data=[]
-                continserts=0
-        with self.conn:
-            if reverse:
-                self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",parallel_data_rev)
-            else:
-                self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",parallel_data)
-            if feed_monolingual:
-                if reverse:
-                    self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",tl_data)
-                    self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",sl_data)
-                else:
-                    self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",sl_data)
-                    self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",tl_data) 
-        self.conn.commit()
-                    
-    def load_parallel_corpus_tmx(self,tmx_file, sl_code="", tl_code="", feed_monolingual=True):
-        '''Loads a parallel corpus from a TMX file. Source and target language codes should be given. The codes must be the exactly the same as in the TMX file. A list of codes separated by comma is allowed. '''
-        continserts=0
+    @bulk_loader
+    def load_parallel_corpus_tabtxt(self,corpusfile, feed_monolingual=True, reverse=False, encoding="utf-8", verbose=False, dedup=False, resume=False):
+        '''Loads a parallel corpus in tabbed text format (that is, in two independent files). It expects one segment per line. With resume=True an interrupted load of the same file continues from its last checkpoint.'''
+        cf=open_text(corpusfile,encoding=encoding)
+        def pairs():
+            for linia in cf:
+                linia=linia.rstrip()
+                camps=linia.split("\t")
+                if len(camps)>=2:
+                    yield(camps[0].rstrip(),camps[1].rstrip())
+        source=os.path.abspath(corpusfile)
+        position=self.resume_position("load_parallel_corpus_tabtxt",source,resume)
+        stats=self.run_ingestion_pipeline(self.parallel_corpus_batches(pairs(),feed_monolingual,reverse,dedup,("load_parallel_corpus_tabtxt",source,position)),verbose)
+        self.finish_checkpoint("load_parallel_corpus_tabtxt",source)
+        cf.close()
+        if feed_monolingual and self.token_store_on_load:
+            self.build_token_store("sl_corpus")
+            self.build_token_store("tl_corpus")
+        return(stats)
+        
+    @bulk_loader
+    def load_parallel_corpus_tmx(self,tmx_file, sl_code="", tl_code="", feed_monolingual=True, verbose=False, dedup=False, resume=False):
+        '''Loads a parallel corpus from a TMX file. Source and target language codes should be given. The codes must be the exactly the same as in the TMX file. A list of codes separated by comma is allowed. With dedup=True repeated translation units are stored once with their multiplicity. With resume=True an interrupted load of the same file continues from its last checkpoint (the units already loaded are parsed again, but not inserted).'''
         slcodes=[]
         for slc in sl_code.split(","):
             slcodes.append(slc.strip())
         tlcodes=[]
         for tlc in tl_code.split(","):
             tlcodes.append(tlc.strip())
-        data1=[]
-        data2=[]
-        datap=[]
-        sl_segment=""
-        tl_segment=""
-        current_lang=""
-        for event, elem in etree.iterparse(tmx_file,events=("start","end")):
-            if event=='start':
-                if elem.tag=="tu" and not sl_segment=="" and not tl_segment=="":
-                    continserts+=1
-                    
-                    record1=[]
-                    record2=[]
-                    recordp=[]
-                    record1.append(sl_segment)
-                    data1.append(record1)
-                    record2.append(tl_segment)
-                    data2.append(record2)
-                    recordp.append(sl_segment)
-                    recordp.append(tl_segment)
-                    datap.append(recordp)
-                    sl_segment=""
-                    tl_segment=""
-                    if continserts==self.maxinserts:
-                        self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",datap)
-                        if feed_monolingual:
-                            self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",data1) 
-                            self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",data2)
-                        data1=[]
-                        data2=[]
-                        datap=[]
-                        continserts=0
-                        self.conn.commit()
-                elif elem.tag=="tuv":
-                    current_lang=elem.attrib['{http://www.w3.org/XML/1998/namespace}lang']
-                elif elem.tag=="seg":
-                    if elem.text:
-                        segmentext=elem.text
-                    else:
-                        segmentext=""
-                    if current_lang in slcodes:
-                        sl_segment=segmentext
-                    if current_lang in tlcodes:
-                        tl_segment=segmentext 
-        with self.conn:
-            self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",datap)
-            if feed_monolingual:
-                self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",data1)
-                self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",data2) 
-        self.conn.commit()                
+        source=os.path.abspath(tmx_file)
+        position=self.resume_position("load_parallel_corpus_tmx",source,resume)
+        stats=self.run_ingestion_pipeline(self.parallel_corpus_batches(iter_tmx_pairs(tmx_file,slcodes,tlcodes),feed_monolingual,dedup=dedup,checkpoint=("load_parallel_corpus_tmx",source,position)),verbose)
+        self.finish_checkpoint("load_parallel_corpus_tmx",source)
+        if feed_monolingual and self.token_store_on_load:
+            self.build_token_store("sl_corpus")
+            self.build_token_store("tl_corpus")
+        return(stats)
                         
-    def load_parallel_corpus_sdltm(self,sdltmfile, feed_monolingual=True):
-        '''Loads a parallel corpus from a SDLTM file.'''
-        
+    @bulk_loader
+    def load_parallel_corpus_sdltm(self,sdltmfile, feed_monolingual=True, workers=None, verbose=False, dedup=False):
+        '''Loads a parallel corpus from a SDLTM file. The translation units are read in batches and their XML is parsed by a pool of workers processes (by default, one per CPU), keeping the order of the memory. Returns the statistics of the load (see run_ingestion_pipeline) plus the number of units that couldn't be parsed (parse_errors) and of units with an empty side (empty_units).'''
+        parse_stats={"parse_errors":0,"empty_units":0}
         connSDLTM=sqlite3.connect(sdltmfile)
-        curSDLTM = connSDLTM.cursor() 
-        curSDLTM.execute('select source_segment,target_segment from translation_units;')
-        dataSDLTM=curSDLTM.fetchall()
-        data1=[]
-        data2=[]
-        datap=[]
-        continserts=0
-        for d in dataSDLTM:
-            ssxml=d[0]
-            tsxml=d[1]
-            record1=[]
-            record2=[]
-            recordp=[]
-            try:
-                rootSL = etree.fromstring(ssxml)
-                for text in rootSL.iter('Value'):
-                    sltext="".join(text.itertext()).replace("\n"," ")
-                rootTL = etree.fromstring(tsxml)
-                for text in rootTL.iter('Value'):
-                    tltext="".join(text.itertext()).replace("\n"," ")
-                if not sltext=="" and not tltext=="":
-                    continserts+=1
-                    record1.append(sltext)
-                    data1.append(record1)
-                    record2.append(tltext)
-                    data2.append(record2)
-                    recordp.append(sltext)
-                    recordp.append(tltext)    
-                    datap.append(recordp)
-            except:
-                print("ERROR")
-            if continserts==self.maxinserts:
-                self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",datap)
-                if feed_monolingual:
-                    self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",data1) 
-                    self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",data2)
-                data1=[]
-                data2=[]
-                datap=[]
-                continserts=0
-                self.conn.commit()
-        with self.conn:
-            self.cur.executemany("INSERT INTO parallel_corpus (segmentSL, segmentTL) VALUES (?,?)",datap)
-            if feed_monolingual:
-                self.cur.executemany("INSERT INTO sl_corpus (segment) VALUES (?)",data1)
-                self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",data2) 
-            self.conn.commit()  
-        
+        def pairs():
+            curSDLTM=connSDLTM.cursor()
+            curSDLTM.execute('select source_segment,target_segment from translation_units;')
+            def batches():
+                while True:
+                    rows=curSDLTM.fetchmany(self.maxinserts)
+                    if len(rows)==0:
+                        break
+                    yield(rows)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                for parsed,errors,empty in bounded_map(executor,parse_sdltm_units,batches()):
+                    parse_stats["parse_errors"]+=errors
+                    parse_stats["empty_units"]+=empty
+                    for pair in parsed:
+                        yield(pair)
+        try:
+            stats=self.run_ingestion_pipeline(self.parallel_corpus_batches(pairs(),feed_monolingual,dedup=dedup))
+        finally:
+            connSDLTM.close()
+        stats.update(parse_stats)
+        if verbose:
+            print("Loaded",stats["segments"],"translation units in",round(stats["seconds"],2),"seconds ("+str(round(stats["segments_per_second"]))+" units/s).",stats["parse_errors"],"units couldn't be parsed and",stats["empty_units"],"had an empty segment.")
+        if feed_monolingual and self.token_store_on_load:
+            self.build_token_store("sl_corpus")
+            self.build_token_store("tl_corpus")
+        return(stats)
         
                         
+    @bulk_loader
     def load_sl_tagged_corpus(self,corpusfile,format="TBXTools",encoding="utf-8"):
         '''Loads the source language tagged corpus. 3 formats are allowed:
         - TBXTools: The internal format used by TBXTools. One tagged segment per line.
@@ -758,7 +1619,7 @@ class TBXTools:
         '''
         validformarts=["TBXTools","freeling","conll"]
         #TODO: Raise exception if not a valid format.
-        cf=codecs.open(corpusfile,"r",encoding=encoding)
+        cf=open_text(corpusfile,encoding=encoding)
         if format.lower()=="tbxtools":            
             data=[]
             continserts=0
@@ -830,6 +1691,7 @@ class TBXTools:
                 self.cur.executemany("INSERT INTO sl_tagged_corpus (tagged_segment) VALUES (?)",data)    
             self.conn.commit()
 
+    @bulk_loader
     def load_tl_tagged_corpus(self,corpusfile,format="TBXTools",encoding="utf-8"):
         '''Loads the target language tagged corpus. 3 formats are allowed:
         - TBXTools: The internal format used by TBXTools. One tagged segment per line.
@@ -847,7 +1709,7 @@ class TBXTools:
         '''
         validformarts=["TBXTools","freeling","conll"]
         #TODO: Raise exception if not a valid format.
-        cf=codecs.open(corpusfile,"r",encoding=encoding)
+        cf=open_text(corpusfile,encoding=encoding)
         if format.lower()=="tbxtools":            
             data=[]
             continserts=0
@@ -919,6 +1781,7 @@ class TBXTools:
                 self.cur.executemany("INSERT INTO tl_tagged_corpus (tagged_segment) VALUES (?)",data)    
             self.conn.commit()  
     
+    @bulk_loader
     def load_sl_tagged_corpus_c(self,corpusfile,format="TBXTools",encoding="utf-8"):
         '''Loads the source language tagged corpus. 3 formats are allowed:
         - TBXTools: The internal format used by TBXTools. One tagged segment per line.
@@ -936,7 +1799,7 @@ class TBXTools:
         '''
         validformarts=["TBXTools","freeling","conll"]
         #TODO: Raise exception if not a valid format.
-        cf=codecs.open(corpusfile,"r",encoding=encoding)
+        cf=open_text(corpusfile,encoding=encoding)
         if format.lower()=="tbxtools":            
             data=[]
             continserts=0
@@ -1008,6 +1871,7 @@ class TBXTools:
                 self.cur.executemany("INSERT INTO sl_tagged_corpus_c (tagged_segment) VALUES (?)",data)    
             self.conn.commit()
 
+    @bulk_loader
     def load_tl_tagged_corpus_c(self,corpusfile,format="TBXTools",encoding="utf-8"):
         '''Loads the target language tagged corpus. 3 formats are allowed:
         - TBXTools: The internal format used by TBXTools. One tagged segment per line.
@@ -1025,7 +1889,7 @@ class TBXTools:
         '''
         validformarts=["TBXTools","freeling","conll"]
         #TODO: Raise exception if not a valid format.
-        cf=codecs.open(corpusfile,"r",encoding=encoding)
+        cf=open_text(corpusfile,encoding=encoding)
         if format.lower()=="tbxtools":            
             data=[]
             continserts=0
@@ -1100,7 +1964,8 @@ class TBXTools:
     
     def load_sl_stopwords(self,fitxer,encoding="utf-8"):
         '''Loads the stopwords for the source language.'''
-        fc=codecs.open(fitxer,"r",encoding)
+        self.invalidate_resources("sl_stopwords")
+        fc=open_text(fitxer,encoding=encoding)
         data=[]
         record=[]
         while 1:
@@ -1121,7 +1986,8 @@ class TBXTools:
             
     def load_tl_stopwords(self,fitxer,encoding="utf-8"):
         '''Loads the stopwords for the target language.'''
-        fc=codecs.open(fitxer,"r",encoding)
+        self.invalidate_resources("tl_stopwords")
+        fc=open_text(fitxer,encoding=encoding)
         data=[]
         record=[]
         while 1:
@@ -1142,7 +2008,8 @@ class TBXTools:
 
     def load_sl_inner_stopwords(self,fitxer,encoding="utf-8"):
         '''Loads the stopwords for the source language.'''
-        fc=codecs.open(fitxer,"r",encoding)
+        self.invalidate_resources("sl_inner_stopwords")
+        fc=open_text(fitxer,encoding=encoding)
         data=[]
         record=[]
         while 1:
@@ -1162,7 +2029,8 @@ class TBXTools:
             
     def load_tl_inner_stopwords(self,fitxer,encoding="utf-8"):
         '''Loads the inner stopwords for the target language.'''
-        fc=codecs.open(fitxer,"r",encoding)
+        self.invalidate_resources("tl_inner_stopwords")
+        fc=open_text(fitxer,encoding=encoding)
         data=[]
         record=[]
         while 1:
@@ -1183,7 +2051,9 @@ class TBXTools:
     #evaluation terms
     def load_evaluation_terms_tabtxt(self,arxiu,encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the evaluation terms from a tabulated text.'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        self.invalidate_resources("evaluation_terms")
+        self.drop_indexes(["evaluation_terms"])
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         continserts=0
         for line in cf:
@@ -1216,44 +2086,9 @@ class TBXTools:
         
     def load_evaluation_terms_tbx(self,arxiu,sl_code="",tl_code="",encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the evaluation terms from a TBX file.'''
-        slcodes=[]
-        for slc in sl_code.split(","):
-            slcodes.append(slc.strip())
-        tlcodes=[]
-        for tlc in tl_code.split(","):
-            tlcodes.append(tlc.strip())
-        data=[]
-        slterm=[]
-        tlterm=[]
-        lang=""
-        for event, elem in etree.iterparse(arxiu,events=("start", "end")):
-            tag=elem.tag.replace(self.namespace(elem),"")
-            if event=="end" and tag in ["conceptEntry","termEntry"]:
-                if len(slterm)>0 and len(tlterm)>0:
-                    record=[]
-                    for slt in slterm:
-                        if self.specificSLtokenizer:
-                            tokens=self.SLtokenizer.tokenize(slt).split()
-                        else:
-                            tokens=slt.split()
-                        if len(tokens)>=nmin and len(tokens)<=nmax:
-                            tlt=", ".join(tlterm)
-                            record.append(slt)
-                            record.append(tlt)
-                            data.append(record)  
-                            record=[]
-                    slterm=[]
-                    tlterm=[]
-            elif event=="start" and tag=="langSec":
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in slcodes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in tlcodes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-            elif event=="start" and tag=="term":
-                if lang in slcodes: slterm.append("".join(elem.itertext()).lstrip().rstrip())
-                elif lang in tlcodes: tlterm.append("".join(elem.itertext()).lstrip().rstrip())
-        self.cur.executemany("INSERT INTO evaluation_terms (sl_term,tl_term) VALUES (?,?)",data)   
-        self.conn.commit()
+        self.invalidate_resources("evaluation_terms")
+        self.drop_indexes(["evaluation_terms"])
+        self.insert_in_batches("INSERT INTO evaluation_terms (sl_term,tl_term) VALUES (?,?)",self.tbx_term_pairs(arxiu,sl_code,tl_code,nmin,nmax))
     #
     def load_validated_terms(self,terms):
         """Load a list of tuples containig source-target terms)."""
@@ -1282,7 +2117,8 @@ class TBXTools:
     #reference_terms
     def load_reference_terms_tabtxt(self,arxiu,encoding="utf-8",nmin=0,nmax=1000, reverse=False):
         '''Loads the reference terms from a tabulated text.'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        self.drop_indexes(["reference_terms"])
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         continserts=0
         for line in cf:
@@ -1321,47 +2157,12 @@ class TBXTools:
         
     def load_reference_terms_tbx(self,arxiu,sl_code="",tl_code="",encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the evaluation terms from a TBX file.'''
-        slcodes=[]
-        for slc in sl_code.split(","):
-            slcodes.append(slc.strip())
-        tlcodes=[]
-        for tlc in tl_code.split(","):
-            tlcodes.append(tlc.strip())
-        data=[]
-        slterm=[]
-        tlterm=[]
-        lang=""
-        for event, elem in etree.iterparse(arxiu,events=("start", "end")):
-            tag=elem.tag.replace(self.namespace(elem),"")
-            if event=="end" and tag in ["conceptEntry","termEntry"]:
-                if len(slterm)>0 and len(tlterm)>0:
-                    record=[]
-                    for slt in slterm:
-                        if self.specificSLtokenizer:
-                            tokens=self.SLtokenizer.tokenize(slt).split()
-                        else:
-                            tokens=slt.split()
-                        if len(tokens)>=nmin and len(tokens)<=nmax:
-                            tlt=", ".join(tlterm)
-                            record.append(slt)
-                            record.append(tlt)
-                            data.append(record)  
-                            record=[]
-                    slterm=[]
-                    tlterm=[]
-            elif event=="start" and tag=="langSec":
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in slcodes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in tlcodes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-            elif event=="start" and tag=="term":
-                if lang in slcodes: slterm.append("".join(elem.itertext()).lstrip().rstrip())
-                elif lang in tlcodes: tlterm.append("".join(elem.itertext()).lstrip().rstrip())
-        self.cur.executemany("INSERT INTO reference_terms (sl_term,tl_term) VALUES (?,?)",data)   
-        self.conn.commit()
+        self.drop_indexes(["reference_terms"])
+        self.insert_in_batches("INSERT INTO reference_terms (sl_term,tl_term) VALUES (?,?)",self.tbx_term_pairs(arxiu,sl_code,tl_code,nmin,nmax))
     
     def load_reference_terms_csv(self,arxiu,encoding="utf-8",nmin=0,nmax=1000,CSVdelimiter=",",CSVquotechar=None,CSVescapechar=None,CSVSLTerm=1,CSVTLTerm=2):
-        csv_file=codecs.open(arxiu,"r",encoding=encoding)
+        self.drop_indexes(["reference_terms"])
+        csv_file=open_text(arxiu,encoding=encoding)
         csv_reader = csv.reader(csv_file, delimiter=",", quotechar=CSVquotechar, escapechar=CSVescapechar)
         record=[]
         data=[]
@@ -1372,35 +2173,53 @@ class TBXTools:
             record=[]
         self.cur.executemany("INSERT INTO reference_terms (sl_term,tl_term) VALUES (?,?)",data)   
         self.conn.commit()
+    @bulk_loader
     def load_reference_terms_excel(self,file,nmin=0,nmax=1000,sheet_name=1,first_row=1,sourceColumn="A",targetColumn="B"):
-        workbook = load_workbook(filename=file)
-        data=[]
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            for row in sheet.rows:
-                source=""
-                target=""
-                record=[]
-                for cell in row:
-                    
-                    if isinstance(cell, openpyxl.cell.cell.MergedCell):
-                        # Skip this cell
+        '''Loads the reference terms from an Excel file, reading the source terms from sourceColumn and the target terms from targetColumn starting at first_row. sheet_name is the name or the number (starting at 1) of the sheet, or None to read all the sheets. The workbook is read in read-only mode, row by row, so large files are loaded in bounded memory.'''
+        self.drop_indexes(["reference_terms"])
+        sourceIndex=openpyxl.utils.column_index_from_string(sourceColumn)
+        targetIndex=openpyxl.utils.column_index_from_string(targetColumn)
+        min_col=min(sourceIndex,targetIndex)
+        workbook=load_workbook(filename=file,read_only=True,data_only=True)
+        try:
+            if sheet_name==None:
+                sheets=workbook.worksheets
+            elif isinstance(sheet_name,int):
+                sheets=[workbook.worksheets[sheet_name-1]]
+            else:
+                sheets=[workbook[sheet_name]]
+            data=[]
+            for sheet in sheets:
+                for row in sheet.iter_rows(min_row=first_row,min_col=min_col,max_col=max(sourceIndex,targetIndex),values_only=True):
+                    if len(row)<=max(sourceIndex,targetIndex)-min_col:
                         continue
-                    if cell.column_letter==sourceColumn: 
-                        source=cell.value
-                    elif cell.column_letter==targetColumn: 
-                        target=cell.value
-                if not source=="" and not target=="":
-                    record.append(source)
-                    record.append(target)  
-                    data.append(record)
-        self.cur.executemany("INSERT INTO reference_terms (sl_term,tl_term) VALUES (?,?)",data)
-        self.conn.commit()
+                    source=row[sourceIndex-min_col]
+                    target=row[targetIndex-min_col]
+                    if source==None or target==None:
+                        continue
+                    source=str(source).strip()
+                    target=str(target).strip()
+                    if source=="" or target=="":
+                        continue
+                    if self.specificSLtokenizer:
+                        tokens=self.SLtokenizer.tokenize(source).split()
+                    else:
+                        tokens=source.split()
+                    if len(tokens)>=nmin and len(tokens)<=nmax:
+                        data.append([source,target])
+                    if len(data)==self.maxinserts:
+                        with self.conn:
+                            self.cur.executemany("INSERT INTO reference_terms (sl_term,tl_term) VALUES (?,?)",data)
+                        data=[]
+            with self.conn:
+                self.cur.executemany("INSERT INTO reference_terms (sl_term,tl_term) VALUES (?,?)",data)
+        finally:
+            workbook.close()
 
     #compoundify_terms_sl
     def load_compoundify_terms_sl_txt(self,arxiu,encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the compoundify terms for the source language from a text file (one term per line).'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         continserts=0
         for line in cf:
@@ -1426,42 +2245,12 @@ class TBXTools:
         
     def load_compoundify_terms_sl_tbx(self,arxiu,code="",encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the compoundify terms for the source language from a TBX file.'''
-        codes=[]
-        for slc in code.split(","):
-            codes.append(slc.strip())
-        data=[]
-        term=[]
-        lang=""
-        for event, elem in etree.iterparse(arxiu,events=("start", "end")):
-            tag=elem.tag.replace(self.namespace(elem),"")
-            if event=="end" and tag in ["conceptEntry","termEntry"]:
-                if len(term)>0 and lang in codes:
-                    record=[]
-                    for slt in term:
-                        if self.specificSLtokenizer:
-                            tokens=self.SLtokenizer.tokenize(slt).split()
-                        else:
-                            tokens=slt.split()
-                        if len(tokens)>=nmin and len(tokens)<=nmax:
-                            record.append(slt)
-                            data.append(record)  
-                            record=[]
-                    term=[]
-            elif event=="start" and tag=="langSec":
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in codes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-                else:
-                    lang=""
-            elif event=="start" and tag=="term":
-                if lang in codes: 
-                    term.append("".join(elem.itertext()).lstrip().rstrip())
-        self.cur.executemany("INSERT INTO compoundify_terms_sl (term) VALUES (?)",data)   
-        self.conn.commit()
+        self.insert_in_batches("INSERT INTO compoundify_terms_sl (term) VALUES (?)",self.tbx_terms(arxiu,code,nmin,nmax))
         
     #compoundify_terms_tl
     def load_compoundify_terms_tl_txt(self,arxiu,encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the compoundify terms for the target language from a text file (one term per line).'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         continserts=0
         for line in cf:
@@ -1487,43 +2276,13 @@ class TBXTools:
         
     def load_compoundify_terms_tl_tbx(self,arxiu,code="",encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the compoundify terms for the target language from a TBX file.'''
-        codes=[]
-        for slc in code.split(","):
-            codes.append(slc.strip())
-        data=[]
-        term=[]
-        lang=""
-        for event, elem in etree.iterparse(arxiu,events=("start", "end")):
-            tag=elem.tag.replace(self.namespace(elem),"")
-            if event=="end" and tag in ["conceptEntry","termEntry"]:
-                if len(term)>0 and lang in codes:
-                    record=[]
-                    for slt in term:
-                        if self.specificSLtokenizer:
-                            tokens=self.SLtokenizer.tokenize(slt).split()
-                        else:
-                            tokens=slt.split()
-                        if len(tokens)>=nmin and len(tokens)<=nmax:
-                            record.append(slt)
-                            data.append(record)  
-                            record=[]
-                    term=[]
-            elif event=="start" and tag=="langSec":
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in codes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-                else:
-                    lang=""
-            elif event=="start" and tag=="term":
-                if lang in codes: 
-                    term.append("".join(elem.itertext()).lstrip().rstrip())
-        self.cur.executemany("INSERT INTO compoundify_terms_tl (term) VALUES (?)",data)   
-        self.conn.commit()
+        self.insert_in_batches("INSERT INTO compoundify_terms_tl (term) VALUES (?)",self.tbx_terms(arxiu,code,nmin,nmax))
         
     #tsr terms
     
     def load_tsr_terms_txt(self,arxiu,encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the TSR terms from a text file (one term per line).'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         continserts=0
         for line in cf:
@@ -1552,7 +2311,7 @@ class TBXTools:
         tofind=[]
         if isinstance(SLterms, str):
             if os.path.exists(SLterms):
-                entrada=codecs.open(SLterms)
+                entrada=open_text(SLterms)
                 for linia in entrada:
                     linia=linia.rstrip()
                     tofind.append(linia)
@@ -1583,43 +2342,14 @@ class TBXTools:
         
     def load_tsr_terms_tbx(self,arxiu,code="",encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the TSR terms from a TBX file.'''
-        codes=[]
-        for slc in code.split(","):
-            codes.append(slc.strip())
-        data=[]
-        term=[]
-        lang=""
-        for event, elem in etree.iterparse(arxiu,events=("start", "end")):
-            tag=elem.tag.replace(self.namespace(elem),"")
-            if event=="end" and tag in ["conceptEntry","termEntry"]:
-                if len(term)>0 and lang in codes:
-                    record=[]
-                    for slt in term:
-                        if self.specificSLtokenizer:
-                            tokens=self.SLtokenizer.tokenize(slt).split()
-                        else:
-                            tokens=slt.split()
-                        if len(tokens)>=nmin and len(tokens)<=nmax:
-                            record.append(slt)
-                            data.append(record)  
-                            record=[]
-                    term=[]
-            elif event=="start" and tag=="langSec":
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in codes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-                else:
-                    lang=""
-            elif event=="start" and tag=="term":
-                if lang in codes: 
-                    term.append("".join(elem.itertext()).lstrip().rstrip())
-        self.cur.executemany("INSERT INTO tsr_terms (term) VALUES (?)",data)   
-        self.conn.commit()
+        self.insert_in_batches("INSERT INTO tsr_terms (term) VALUES (?)",self.tbx_terms(arxiu,code,nmin,nmax))
         
     #exclusion_terms
     
     def load_exclusion_terms_tabtxt(self,arxiu,encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the exclusion terms from a tabulated text.'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        self.invalidate_resources("exclusion_terms")
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         continserts=0
         for line in cf:
@@ -1652,49 +2382,14 @@ class TBXTools:
         
     def load_exclusion_terms_tbx(self,arxiu,sl_code="",tl_code="",encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the exclusion terms from a TBX file.'''
-        slcodes=[]
-        for slc in sl_code.split(","):
-            slcodes.append(slc.strip())
-        tlcodes=[]
-        for tlc in tl_code.split(","):
-            tlcodes.append(tlc.strip())
-        data=[]
-        slterm=[]
-        tlterm=[]
-        lang=""
-        for event, elem in etree.iterparse(arxiu,events=("start", "end")):
-            tag=elem.tag.replace(self.namespace(elem),"")
-            if event=="end" and tag in ["conceptEntry","termEntry"]:
-                if len(slterm)>0 and len(tlterm)>0:
-                    record=[]
-                    for slt in slterm:
-                        if self.specificSLtokenizer:
-                            tokens=self.SLtokenizer.tokenize(slt).split()
-                        else:
-                            tokens=slt.split()
-                        if len(tokens)>=nmin and len(tokens)<=nmax:
-                            tlt=", ".join(tlterm)
-                            record.append(slt)
-                            record.append(tlt)
-                            data.append(record)  
-                            record=[]
-                    slterm=[]
-                    tlterm=[]
-            elif event=="start" and tag=="langSec":
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in slcodes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-                if elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"] in tlcodes:
-                    lang=elem.attrib["{http://www.w3.org/XML/1998/namespace}lang"]
-            elif event=="start" and tag=="term":
-                if lang in slcodes: slterm.append("".join(elem.itertext()).lstrip().rstrip())
-                elif lang in tlcodes: tlterm.append("".join(elem.itertext()).lstrip().rstrip())
-        self.cur.executemany("INSERT INTO exclusion_terms (sl_term,tl_term) VALUES (?,?)",data)   
-        self.conn.commit()
+        self.invalidate_resources("exclusion_terms")
+        self.insert_in_batches("INSERT INTO exclusion_terms (sl_term,tl_term) VALUES (?,?)",self.tbx_term_pairs(arxiu,sl_code,tl_code,nmin,nmax))
         
     #EXCLUSION NO TERMS
     def load_exclusion_noterms_tabtxt(self,arxiu,encoding="utf-8",nmin=0,nmax=1000):
         '''Loads the exclusion no terms from a tabulated text.'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        self.invalidate_resources("exclusion_noterms")
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         continserts=0
         for line in cf:
@@ -1729,12 +2424,66 @@ class TBXTools:
     def namespace(self,element):
         m = re.match(r'\{.*\}', element.tag)
         return m.group(0) if m else ''
+    
+    def tbx_term_pairs(self,arxiu,sl_code="",tl_code="",nmin=0,nmax=1000):
+        '''Yields [source term, target terms separated by ", "] for every source language term (with nmin to nmax tokens) of the concept entries of a TBX file having terms in both languages. sl_code and tl_code can hold several language codes separated by commas.'''
+        slcodes=[]
+        for slc in sl_code.split(","):
+            slcodes.append(slc.strip())
+        tlcodes=[]
+        for tlc in tl_code.split(","):
+            tlcodes.append(tlc.strip())
+        for concept in iter_tbx_concepts(arxiu):
+            slterm=[]
+            tlterm=[]
+            for lang,term in concept:
+                if lang in slcodes:
+                    slterm.append(term)
+                elif lang in tlcodes:
+                    tlterm.append(term)
+            if len(slterm)>0 and len(tlterm)>0:
+                tlt=", ".join(tlterm)
+                for slt in slterm:
+                    if self.tokens_in_range(slt,nmin,nmax):
+                        yield([slt,tlt])
+    
+    def tbx_terms(self,arxiu,code="",nmin=0,nmax=1000):
+        '''Yields [term] for every term (with nmin to nmax tokens) in the given languages of the concept entries of a TBX file. code can hold several language codes separated by commas.'''
+        codes=[]
+        for slc in code.split(","):
+            codes.append(slc.strip())
+        for concept in iter_tbx_concepts(arxiu):
+            for lang,term in concept:
+                if lang in codes and self.tokens_in_range(term,nmin,nmax):
+                    yield([term])
+    
+    def tokens_in_range(self,term,nmin,nmax):
+        '''Returns True if the number of tokens of term (with the source language tokenizer) is between nmin and nmax.'''
+        if self.specificSLtokenizer:
+            tokens=self.SLtokenizer.tokenize(term).split()
+        else:
+            tokens=term.split()
+        return(len(tokens)>=nmin and len(tokens)<=nmax)
+    
+    def insert_in_batches(self,sql,records):
+        '''Inserts the records yielded by an iterator with the given SQL statement, committing every self.maxinserts records.'''
+        data=[]
+        for record in records:
+            data.append(record)
+            if len(data)==self.maxinserts:
+                with self.conn:
+                    self.cur.executemany(sql,data)
+                data=[]
+        with self.conn:
+            self.cur.executemany(sql,data)
         
     def find_translation_reference_terms(self,term):
-        self.cur.execute("SELECT tl_term FROM reference_terms where sl_term='"+str(term)+"'")
+        '''Returns the translations of term in the reference terms separated by ", " (None if there are no translations). It can be called from several threads at the same time.'''
+        if self.is_writer_thread():
+            self.create_indexes("find_translation_reference_terms")
         tlterms=[]
-        for self.s in self.cur.fetchall():
-            tlterms.append(self.s[0])
+        for s in self.get_reader().execute("SELECT tl_term FROM reference_terms where sl_term=?",(str(term),)):
+            tlterms.append(s[0])
         if len(tlterms)>0:
             return(", ".join(tlterms))
         else:
@@ -1743,7 +2492,7 @@ class TBXTools:
     
     def load_sl_exclusion_regexps(self,arxiu,encoding="utf-8"):
         '''Loads the exclusion regular expressions for the source language.'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         for line in cf:
             line=line.rstrip()
@@ -1756,7 +2505,7 @@ class TBXTools:
             
     def load_tl_exclusion_regexps(self,arxiu,encoding="utf-8"):
         '''Loads the exclusion regular expressions for the target language.'''
-        cf=codecs.open(arxiu,"r",encoding=encoding)
+        cf=open_text(arxiu,encoding=encoding)
         data=[]
         for line in cf:
             line=line.rstrip()
@@ -1771,35 +2520,28 @@ class TBXTools:
     def show_term_candidates(self,limit=-1,minfreq=2, minmeasure=-1, show_frequency=True, show_measure=False, mark_eval=False, verbose=False):
         '''Shows the term candidates in the screen.'''
         measure=0
-        knownterms=[]
-        knownoterms=[]
-        with self.conn:
-            self.cur.execute("SELECT sl_term FROM exclusion_terms")
-            for s in self.cur.fetchall():
-                knownterms.append(s[0])
-        with self.conn:
-            self.cur.execute("SELECT sl_term FROM exclusion_noterms")
-            for s in self.cur.fetchall():
-                knownnoterms.append(s[0])
+        knownterms=self.get_resource("exclusion_terms")
+        knownnoterms=self.get_resource("exclusion_noterms")
+        evaluation_terms=self.get_resource("evaluation_terms")
         with self.conn:
             self.cur.execute("SELECT frequency,value,n,candidate FROM term_candidates order by value desc, frequency desc, random() limit "+str(limit))
             for s in self.cur.fetchall():
                 frequency=s[0]
                 if s[1]==None:
-                    measure==0
+                    measure=0
                 else:
                     measure=s[1]
                 n=s[2]
                 candidate=s[3]
-                if n>=n_min and n<=n_max and not candidate in knownterms and not candidate in knownoterms:
+                if n>=self.n_min and n<=self.n_max and not candidate in knownterms and not candidate in knownnoterms:
                     if mark_eval:
                         if candidate in evaluation_terms:
                             candidate="*"+candidate
-                    if show_frequency and not show_measure:
-                        cadena=str(frequency)+"\t"+candidate
-                    if not show_frequency and show_measure:
+                    if show_measure and not show_frequency:
                         cadena=str(measure)+"\t"+candidate
-                    if show_measure and show_frequency:
+                    elif show_frequency and not show_measure:
+                        cadena=str(frequency)+"\t"+candidate
+                    elif show_frequency and show_measure:
                         cadena=str(frequency)+"\t"+str(measure)+"\t"+candidate
                     else:
                         cadena=candidate
@@ -1842,22 +2584,15 @@ class TBXTools:
         '''Saves the term candidates in a file.'''
         sortida=codecs.open(outfile,"w",encoding="utf-8")
         measure=0
-        knownterms=[]
-        knownnoterms=[]
-        with self.conn:
-            self.cur.execute("SELECT sl_term FROM exclusion_terms")
-            for s in self.cur.fetchall():
-                knownterms.append(s[0])
-        with self.conn:
-            self.cur.execute("SELECT sl_term FROM exclusion_noterms")
-            for s in self.cur.fetchall():
-                knownnoterms.append(s[0])
+        knownterms=self.get_resource("exclusion_terms")
+        knownnoterms=self.get_resource("exclusion_noterms")
+        evaluation_terms=self.get_resource("evaluation_terms")
         with self.conn:
             self.cur.execute("SELECT frequency,value,n,candidate FROM term_candidates order by value desc, frequency desc, random() limit "+str(limit))
             for s in self.cur.fetchall():
                 frequency=s[0]
                 if s[1]==None:
-                    measure==0
+                    measure=0
                 else:
                     measure=s[1]
                 n=s[2]
@@ -1878,43 +2613,543 @@ class TBXTools:
                         print(cadena)
                     sortida.write(cadena+"\n")
                     
-    #STATISTICAL TERM EXTRACTION
+    #RESOURCE CACHE
     
-    def ngram_calculation (self,nmin,nmax,minfreq=2,corpus="sl_corpus"):
-        '''Performs the calculation of ngrams.'''
-        ngramsFD=FreqDist()
-        tokensFD=FreqDist()
-        n_nmin=nmin
-        n_max=nmax
-            
+    def get_resource(self,table):
+        '''Returns the contents of a resource table (see RESOURCE_COLUMNS), like the stopwords or the exclusion terms, as a frozenset. The resource is read from the project the first time and kept in memory until it is loaded or deleted again.'''
+        if not table in self.resources:
+            resource=set()
+            for s in self.conn.execute("SELECT "+RESOURCE_COLUMNS[table]+" FROM "+table):
+                resource.add(s[0])
+            self.resources[table]=frozenset(resource)
+        return(self.resources[table])
+    
+    def invalidate_resources(self,*tables):
+        '''Removes the given resource tables from the cache, so they are read again the next time they are needed.'''
+        for table in tables:
+            self.resources.pop(table,None)
+    
+    #TOKEN STORE
+    
+    def create_token_store_tables(self):
+        '''Creates the tables of the integer-interned token store (if they don't exist yet): the vocabulary and, for sl_corpus and tl_corpus, one packed array of uint32 token ids per segment.'''
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vocabulary (id INTEGER PRIMARY KEY, token TEXT UNIQUE)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sl_corpus_tokens (id INTEGER PRIMARY KEY, token_ids BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tl_corpus_tokens (id INTEGER PRIMARY KEY, token_ids BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS token_stores (corpus TEXT PRIMARY KEY, tokenizer TEXT)")
+    
+    def create_other_token_store_tables(self):
+        '''Creates the token stores of sl_corpus tokenized with the target language tokenizer and of tl_corpus tokenized with the source language one (if they don't exist yet), so using the other tokenizer doesn't rebuild the store of the corpus.'''
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sl_corpus_tl_tokens (id INTEGER PRIMARY KEY, token_ids BLOB)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tl_corpus_sl_tokens (id INTEGER PRIMARY KEY, token_ids BLOB)")
+        self.conn.commit()
+    
+    def token_store(self,corpus,side=None):
+        '''Returns the name of the token store of sl_corpus or tl_corpus tokenized with the tokenizer of the given side (by default, the language of the corpus).'''
+        if side==None or side==corpus.split("_")[0]:
+            return(corpus+"_tokens")
+        return(corpus+"_"+side+"_tokens")
+    
+    def token_stores_of(self,corpus):
+        '''Returns the names of all the token stores of sl_corpus or tl_corpus.'''
+        return([self.token_store(corpus,"sl"),self.token_store(corpus,"tl")])
+    
+    def get_tokenizer(self,side="sl"):
+        '''Returns the name ("" for whitespace tokenization) and the tokenization function (segment -> list of tokens) used for the source (side="sl") or target (side="tl") language.'''
+        if side=="sl" and self.specificSLtokenizer:
+            return(self.SLtokenizer_name,lambda segment: self.SLtokenizer.tokenize(segment).split())
+        elif side=="tl" and self.specificTLtokenizer:
+            return(self.TLtokenizer_name,lambda segment: self.TLtokenizer.tokenize(segment).split())
+        return("",str.split)
+    
+    def load_vocabulary(self):
+        '''Loads the vocabulary of the token store in memory (self.vocabulary: id -> token, self.vocabulary_ids: token -> id).'''
+        self.vocabulary=[]
+        self.vocabulary_ids={}
+        for s in self.conn.execute("SELECT id, token FROM vocabulary ORDER BY id"):
+            self.vocabulary.append(s[1])
+            self.vocabulary_ids[s[1]]=s[0]
+    
+    def build_token_store(self,corpus="sl_corpus",side=None):
+        '''Tokenizes the segments of sl_corpus or tl_corpus that are not yet in the token store and stores them as packed arrays of uint32 token ids. By default sl_corpus uses the source language tokenizer and tl_corpus the target language one (side="sl" or side="tl" changes it). Every side has its own store (see token_store). If the tokenizer is not the one used to build the store, the store is rebuilt. External corpora have no token store: they are tokenized when they are read.'''
+        if not self.get_external_corpus(corpus)==None:
+            return
+        if side==None:
+            side=corpus.split("_")[0]
+        store=self.token_store(corpus,side)
+        #the stores are recorded in token_stores by their name without "_tokens" (the corpus name for the store of its own language)
+        key=store[:-len("_tokens")]
+        tokenizer_name,tokenize=self.get_tokenizer(side)
+        if self.vocabulary==None:
+            self.load_vocabulary()
         with self.conn:
-            if corpus=="sl_corpus":
-                self.cur.execute('SELECT segment from sl_corpus')
-            elif corpus=="tl_corpus":
-                self.cur.execute('SELECT segment from tl_corpus')
-            for s in self.cur.fetchall():
-                segment=s[0]
-                for n in range(nmin,nmax+1): #we DON'T calculate one order bigger in order to detect nested candidates
-                    if self.specificSLtokenizer:
-                        tokens=self.SLtokenizer.tokenize(segment).split()
+            row=self.conn.execute("SELECT tokenizer FROM token_stores WHERE corpus=?",(key,)).fetchone()
+            if not row==None and not row[0]==tokenizer_name:
+                self.conn.execute("DELETE FROM "+store)
+            self.conn.execute("INSERT OR REPLACE INTO token_stores (corpus, tokenizer) VALUES (?,?)",(key,tokenizer_name))
+        last_id=-1
+        while 1:
+            results=self.conn.execute("SELECT c.id, c.segment FROM "+corpus+" c LEFT JOIN "+store+" t ON c.id=t.id WHERE t.id IS NULL AND c.id>? ORDER BY c.id LIMIT ?",(last_id,self.maxinserts)).fetchall()
+            if len(results)==0:
+                break
+            data=[]
+            newtokens=[]
+            try:
+                for s in results:
+                    data.append((s[0],self.pack_tokens(tokenize(s[1]),newtokens)))
+                with self.conn:
+                    self.conn.executemany("INSERT INTO vocabulary (id, token) VALUES (?,?)",newtokens)
+                    self.conn.executemany("INSERT INTO "+store+" (id, token_ids) VALUES (?,?)",data)
+            except:
+                #the vocabulary in memory may hold tokens that were not stored
+                self.vocabulary=None
+                self.vocabulary_ids=None
+                raise
+            last_id=results[-1][0]
+    
+    def pack_tokens(self,tokens,newtokens):
+        '''Converts a list of tokens into the packed array of token ids of the token store, adding the unknown tokens to the vocabulary in memory and to the list newtokens of (id, token) to be stored.'''
+        vocabulary_ids=self.vocabulary_ids
+        ids=[]
+        for token in tokens:
+            if not token in vocabulary_ids:
+                vocabulary_ids[token]=len(self.vocabulary)
+                self.vocabulary.append(token)
+                newtokens.append((vocabulary_ids[token],token))
+            ids.append(vocabulary_ids[token])
+        return(np.array(ids,dtype="<u4").tobytes())
+    
+    def unpack_tokens(self,token_ids):
+        '''Converts a packed array of token ids of the token store into the list of tokens.'''
+        vocabulary=self.vocabulary
+        return([vocabulary[i] for i in np.frombuffer(token_ids,dtype="<u4").tolist()])
+    
+    def iter_tokenized_segments(self,corpus="sl_corpus",side=None,min_id=0):
+        '''Yields (id, tokens) for every segment of sl_corpus or tl_corpus with an id greater than min_id, reading them from the token store (that is updated first if needed). The segments of external corpora are tokenized as they are read.'''
+        external=self.get_external_corpus(corpus)
+        if not external==None:
+            if side==None:
+                side=corpus.split("_")[0]
+            tokenize=self.get_tokenizer(side)[1]
+            for id,segment in external.iter_segments(min_id):
+                yield((id,tokenize(segment)))
+            return
+        self.build_token_store(corpus,side)
+        cur=self.conn.cursor()
+        cur.execute("SELECT id, token_ids FROM "+self.token_store(corpus,side)+" WHERE id>? ORDER BY id",(min_id,))
+        for s in cur:
+            yield((s[0],self.unpack_tokens(s[1])))
+    
+    def get_tokenized_segment(self,corpus,id):
+        '''Returns the list of tokens of the segment with the given id from the token store of sl_corpus or tl_corpus (build_token_store should be executed first) or, for external corpora, from the file.'''
+        external=self.get_external_corpus(corpus)
+        if not external==None:
+            segment=external.segment(id)
+            if segment==None:
+                return([])
+            return(self.get_tokenizer(corpus.split("_")[0])[1](segment))
+        row=self.conn.execute("SELECT token_ids FROM "+corpus+"_tokens WHERE id=?",(id,)).fetchone()
+        if row==None:
+            return([])
+        return(self.unpack_tokens(row[0]))
+    
+    #SHARDS
+    
+    def create_shards_table(self):
+        '''Creates the table recording the shards of the corpora (if it doesn't exist yet).'''
+        self.conn.execute("CREATE TABLE IF NOT EXISTS shards (id INTEGER PRIMARY KEY AUTOINCREMENT, shard INTEGER, path TEXT, corpus TEXT, first_id INTEGER, last_id INTEGER, segments INTEGER)")
+        self.conn.commit()
+    
+    def create_shards(self,nshards=4,corpora=["sl_corpus","tl_corpus","sl_tagged_corpus"]):
+        '''Splits the given corpora into nshards ranges of segment ids with the same number of segments, so ngram_calculation and tagged_ngram_calculation count every range in a different process (by default, one per CPU). The ranges are read from the project itself (see ngram_range_tasks): no copy of the segments is made. Segments added after sharding are counted as one more range; run create_shards again to redistribute them. The shard files of earlier versions are deleted.'''
+        if self.in_memory:
+            raise Exception("In-memory projects can't be sharded")
+        self.delete_shards()
+        for corpus in corpora:
+            total=self.conn.execute("SELECT count(*) FROM "+corpus).fetchone()[0]
+            if total==0:
+                continue
+            max_id=self.conn.execute("SELECT max(id) FROM "+corpus).fetchone()[0]
+            first_ids=[]
+            for k in range(nshards):
+                row=self.conn.execute("SELECT id FROM "+corpus+" ORDER BY id LIMIT 1 OFFSET ?",(k*total//nshards,)).fetchone()
+                if not row[0] in first_ids:
+                    first_ids.append(row[0])
+            with self.conn:
+                for k in range(len(first_ids)):
+                    first_id=first_ids[k]
+                    if k+1<len(first_ids):
+                        last_id=first_ids[k+1]-1
                     else:
-                        tokens=segment.split()
-                    ngs=ngrams(tokens, n)
-                    for ng in ngs:
-                        ngramsFD[ng]+=1
+                        last_id=max_id
+                    segments=self.conn.execute("SELECT count(*) FROM "+corpus+" WHERE id BETWEEN ? AND ?",(first_id,last_id)).fetchone()[0]
+                    self.conn.execute("INSERT INTO shards (shard, path, corpus, first_id, last_id, segments) VALUES (?,?,?,?,?,?)",(k,None,corpus,first_id,last_id,segments))
+    
+    def delete_shards(self):
+        '''Deletes the shards of the project (and the shard files of earlier versions).'''
+        for s in self.conn.execute("SELECT DISTINCT path FROM shards").fetchall():
+            if not s[0]==None and os.path.isfile(s[0]):
+                os.remove(s[0])
+        with self.conn:
+            self.conn.execute("DELETE FROM shards")
+    
+    def invalidate_counts(self,corpus):
+        '''Called when segments of a corpus are deleted or modified: forgets its shards and the state of its incremental ngram counts.'''
+        self.invalidate_shards(corpus)
+        self.invalidate_ngram_state(corpus)
+    
+    def invalidate_shards(self,corpus):
+        '''Forgets the shards of a corpus whose segments have been deleted or modified in the project.'''
+        with self.conn:
+            self.conn.execute("DELETE FROM shards WHERE corpus=?",(corpus,))
+    
+    def get_shards(self,corpus):
+        '''Returns a list of (path, first_id, last_id, segments) with the shards of a corpus.'''
+        return(self.conn.execute("SELECT path, first_id, last_id, segments FROM shards WHERE corpus=? ORDER BY first_id",(corpus,)).fetchall())
+    
+    def ngram_counting_tasks(self,corpus,nmin,nmax,tokenizer,store=None):
+        '''Returns the tasks (see count_ngrams_task) counting a sharded corpus from the project: one per shard plus one for the segments added after sharding. The store is passed to the tasks as in ngram_range_tasks.'''
+        self.conn.commit()
+        tasks=[]
+        last_id=0
+        for shard in self.get_shards(corpus):
+            path,first_id,shard_last_id,segments=shard
+            tasks.append((self.project_name,corpus,first_id,shard_last_id,nmin,nmax,tokenizer,store))
+            last_id=shard_last_id
+        max_id=self.conn.execute("SELECT max(id) FROM "+corpus).fetchone()[0]
+        if not max_id==None and max_id>last_id:
+            tasks.append((self.project_name,corpus,last_id+1,max_id,nmin,nmax,tokenizer,store))
+        return(tasks)
+    
+    def ngram_range_tasks(self,corpus,nmin,nmax,tokenizer,ntasks,last_id,store=None):
+        '''Returns the tasks (see count_ngrams_task) counting the segments of a corpus of the project with ids up to last_id, partitioned into ntasks ranges of ids with the same number of segments. With the name of a token store (see token_store), that must be built with the tokenizer, the tokens are read from it.'''
+        self.conn.commit()
+        external=self.get_external_corpus(corpus)
+        first_ids=[]
+        if not external==None:
+            total=min(external.segments,last_id)
+            for k in range(ntasks):
+                if not k*total//ntasks+1 in first_ids and k*total//ntasks<total:
+                    first_ids.append(k*total//ntasks+1)
+        else:
+            total=self.conn.execute("SELECT count(*) FROM "+corpus+" WHERE id<=?",(last_id,)).fetchone()[0]
+            for k in range(ntasks):
+                if k*total//ntasks<total:
+                    row=self.conn.execute("SELECT id FROM "+corpus+" ORDER BY id LIMIT 1 OFFSET ?",(k*total//ntasks,)).fetchone()
+                    if not row[0] in first_ids:
+                        first_ids.append(row[0])
+        tasks=[]
+        for k in range(len(first_ids)):
+            if k+1<len(first_ids):
+                range_last_id=first_ids[k+1]-1
+            else:
+                range_last_id=last_id
+            tasks.append((self.project_name,corpus,first_ids[k],range_last_id,nmin,nmax,tokenizer,store))
+        return(tasks)
+    
+    def count_ngrams_parallel(self,tasks,workers=None):
+        '''Runs the ngram counting tasks in a pool of worker processes and merges their counts (in task order, so the result is the same as counting sequentially). Returns the Counter of ngrams and the Counter of tokens.'''
+        ngramsFD=collections.Counter()
+        tokensFD=collections.Counter()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for ngrams_counts,tokens_counts in executor.map(count_ngrams_task,tasks):
+                ngramsFD.update(ngrams_counts)
+                tokensFD.update(tokens_counts)
+        return(ngramsFD,tokensFD)
+    
+    #INCREMENTAL NGRAMS
+    
+    def create_ngram_state_tables(self):
+        '''Creates the tables of the incremental ngram counts (if they don't exist yet): the state of the last count, the counts under minfreq and the multiplicities already counted.'''
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ngram_state (corpus TEXT, nmin INTEGER, nmax INTEGER, minfreq INTEGER, tokenizer TEXT, last_id INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS pending_ngrams (ngram TEXT PRIMARY KEY, n INTEGER, frequency INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counted_multiplicities (id INTEGER PRIMARY KEY, multiplicity INTEGER)")
+        self.conn.commit()
+    
+    def invalidate_ngram_state(self,corpus):
+        '''Forgets the state of the incremental ngram counts of a corpus, so update_ngrams can't be used until ngram_calculation is run again.'''
+        if not self.conn.execute("SELECT corpus FROM ngram_state WHERE corpus=?",(corpus,)).fetchone()==None:
+            with self.conn:
+                self.conn.execute("DELETE FROM ngram_state")
+                self.conn.execute("DELETE FROM pending_ngrams")
+                self.conn.execute("DELETE FROM counted_multiplicities")
+    
+    def update_ngrams(self,verbose=False):
+        '''Adds to the ngrams and tokens the counts of the segments added to the corpus since the last ngram_calculation(incremental=True) or update_ngrams, and of the segments whose multiplicity has grown (dedup mode). Counts under minfreq are kept aside until they reach it. The result is the same as recalculating the ngrams. Returns the number of segments counted.'''
+        state=self.conn.execute("SELECT corpus, nmin, nmax, minfreq, tokenizer, last_id FROM ngram_state").fetchone()
+        if state==None:
+            raise Exception("There are no incremental ngram counts to update. Use ngram_calculation with incremental=True first.")
+        corpus,nmin,nmax,minfreq,tokenizer,last_id=state
+        if not tokenizer==self.get_tokenizer("sl")[0]:
+            raise Exception("The ngrams were calculated with another tokenizer ("+tokenizer+")")
+        self.create_indexes("update_ngrams")
+        new_last_id=max(self.corpus_last_id(corpus),last_id)
+        #plain Counters (a FreqDist updates much slower), with the same most_common order
+        ngramsFD=collections.Counter()
+        tokensFD=collections.Counter()
+        def count(tokens,weight):
+            count_segment_ngrams(tokens,weight,nmin,nmax,ngramsFD,tokensFD)
+        segments=0
+        #segments already counted whose multiplicity has grown since
+        counted={}
+        for s in self.conn.execute("SELECT id, multiplicity FROM counted_multiplicities"):
+            counted[s[0]]=s[1]
+        multiplicities=self.get_multiplicities(corpus)
+        self.build_token_store(corpus,"sl")
+        for id in multiplicities:
+            if id<=last_id and multiplicities[id]>counted.get(id,1):
+                count(self.get_tokenized_segment(corpus,id),multiplicities[id]-counted.get(id,1))
+                segments+=1
+        #new segments
+        for id,tokens in self.iter_tokenized_segments(corpus,side="sl",min_id=last_id):
+            if id>new_last_id:
+                break
+            count(tokens,multiplicities.get(id,1))
+            segments+=1
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_ngrams (ngram TEXT PRIMARY KEY, n INTEGER, frequency INTEGER)")
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_tokens (token TEXT PRIMARY KEY, frequency INTEGER)")
+            self.conn.execute("DELETE FROM temp.new_ngrams")
+            self.conn.execute("DELETE FROM temp.new_tokens")
+            self.conn.executemany("INSERT INTO temp.new_ngrams (ngram, n, frequency) VALUES (?,?,?)",((" ".join(c[0]),len(c[0]),c[1]) for c in ngramsFD.most_common()))
+            self.conn.executemany("INSERT INTO temp.new_tokens (token, frequency) VALUES (?,?)",tokensFD.most_common())
+            #ngrams already over minfreq
+            self.conn.execute("UPDATE ngrams SET frequency=frequency+(SELECT frequency FROM temp.new_ngrams WHERE new_ngrams.ngram=ngrams.ngram) WHERE ngram IN (SELECT ngram FROM temp.new_ngrams)")
+            self.conn.execute("DELETE FROM temp.new_ngrams WHERE ngram IN (SELECT ngram FROM ngrams)")
+            #the rest are added to the counts under minfreq and moved to ngrams when they reach it
+            self.conn.execute("INSERT INTO pending_ngrams (ngram, n, frequency) SELECT ngram, n, frequency FROM temp.new_ngrams WHERE true ON CONFLICT(ngram) DO UPDATE SET frequency=frequency+excluded.frequency")
+            self.conn.execute("INSERT INTO ngrams (ngram, n, frequency) SELECT ngram, n, frequency FROM pending_ngrams WHERE frequency>=? AND ngram IN (SELECT ngram FROM temp.new_ngrams) ORDER BY frequency DESC",(minfreq,))
+            self.conn.execute("DELETE FROM pending_ngrams WHERE frequency>=?",(minfreq,))
+            self.conn.execute("UPDATE tokens SET frequency=frequency+(SELECT frequency FROM temp.new_tokens WHERE new_tokens.token=tokens.token) WHERE token IN (SELECT token FROM temp.new_tokens)")
+            self.conn.execute("INSERT INTO tokens (token, frequency) SELECT token, frequency FROM temp.new_tokens WHERE token NOT IN (SELECT token FROM tokens) ORDER BY frequency DESC")
+            self.conn.execute("UPDATE ngram_state SET last_id=?",(new_last_id,))
+            self.conn.execute("INSERT OR REPLACE INTO counted_multiplicities (id, multiplicity) SELECT id, multiplicity FROM "+corpus+" WHERE multiplicity>1 AND id<=?",(new_last_id,))
+            self.conn.execute("DELETE FROM temp.new_ngrams")
+            self.conn.execute("DELETE FROM temp.new_tokens")
+        if verbose:
+            print(segments,"segments counted")
+        return(segments)
+    
+    #APPROXIMATE AND BOUNDED MEMORY NGRAM COUNTING
+    
+    def weighted_tokenized_segments(self,corpus,last_id):
+        '''Yields (tokens, weight) for the segments of a corpus with ids up to last_id, tokenized with the source language tokenizer. Segments loaded in dedup mode are weighted by their multiplicity.'''
+        multiplicities=self.get_multiplicities(corpus)
+        for id,tokens in self.iter_tokenized_segments(corpus,side="sl"):
+            if id>last_id:
+                break
+            yield((tokens,multiplicities.get(id,1)))
+    
+    def sketch_ngram_counts(self,corpus,nmin,nmax,minfreq,last_id,memory_budget=268435456,sketch_error=None,sketch_confidence=0.99):
+        '''Counts the ngrams of a corpus for ngram_calculation(mode="sketch"): a first pass adds the ngrams to a count-min sketch of memory_budget bytes (or of the width needed for an error of sketch_error times the number of ngrams, if given, with probability sketch_confidence) and a second pass counts exactly the ngrams whose estimate reaches minfreq. The estimates are never lower than the true counts, so no ngram reaching minfreq is lost. Returns the Counter of these ngrams (in the order of their first occurrence) and the Counter of all the tokens.'''
+        depth=max(1,math.ceil(math.log(1/(1-sketch_confidence))))
+        if sketch_error==None:
+            width=memory_budget//(8*depth)
+        else:
+            width=math.ceil(math.e/sketch_error)
+        sketch=CountMinSketch(max(width,1024),depth)
+        tokensC=collections.Counter()
+        hashes=[]
+        weights=[]
+        def flush():
+            sketch.add(np.array(hashes,dtype=np.int64),np.array(weights,dtype=np.uint64))
+            hashes.clear()
+            weights.clear()
+        for tokens,weight in self.weighted_tokenized_segments(corpus,last_id):
+            start=len(hashes)
+            hashes.extend(map(hash,segment_ngrams(tokens,nmin,nmax)))
+            weights.extend([weight]*(len(hashes)-start))
+            if weight==1:
+                tokensC.update(tokens)
+            else:
                 for token in tokens:
-                    tokensFD[token]+=1
+                    tokensC[token]+=weight
+            if len(hashes)>=SKETCH_BATCH_SIZE:
+                flush()
+        flush()
+        ngramsC=collections.Counter()
+        batch=[]
+        weights=[]
+        def count():
+            estimates=sketch.estimate(np.array([hash(ng) for ng in batch],dtype=np.int64))
+            for ng,weight,estimate in zip(batch,weights,estimates.tolist()):
+                if estimate>=minfreq:
+                    ngramsC[ng]+=weight
+            batch.clear()
+            weights.clear()
+        for tokens,weight in self.weighted_tokenized_segments(corpus,last_id):
+            start=len(batch)
+            batch.extend(segment_ngrams(tokens,nmin,nmax))
+            weights.extend([weight]*(len(batch)-start))
+            if len(batch)>=SKETCH_BATCH_SIZE:
+                count()
+        count()
+        return(ngramsC,tokensC)
+    
+    def external_ngram_counts(self,corpus,nmin,nmax,minfreq,last_id,memory_budget=268435456,temp_dir=None):
+        '''Counts the ngrams of a corpus for ngram_calculation(mode="external") and writes the ngrams reaching minfreq to the ngrams table. The counts are held in a Counter of at most memory_budget bytes that is spilled to a temporary file (in temp_dir or the default temporary directory) as a run sorted by ngram whenever it fills. The runs are merged adding up the counts of every ngram, and the ngrams reaching minfreq are sorted by frequency in runs of the same size and merged again, so they are written in the same order as in exact mode. Returns the Counter of the tokens.'''
+        maxngrams=max(memory_budget//EXTERNAL_NGRAM_BYTES,1000)
+        #the merges hold a block of records of every run
+        fan_in=max(2,min(MERGE_FAN_IN,maxngrams//RUN_BLOCK_SIZE))
+        tokensC=collections.Counter()
+        ngramsC=collections.Counter()
+        with tempfile.TemporaryDirectory(prefix="tbxtools-",dir=temp_dir) as workdir:
+            runs=[]
+            def new_run():
+                runs.append(os.path.join(workdir,"run"+str(len(runs))))
+                return(runs[-1])
+            def merge(paths,combine=None):
+                '''Merges sorted runs, merging them first in groups of fan_in runs if there are more.'''
+                while len(paths)>fan_in:
+                    merged=[]
+                    for i in range(0,len(paths),fan_in):
+                        path=new_run()
+                        records=heapq.merge(*[read_run(run) for run in paths[i:i+fan_in]])
+                        write_run(path,combine(records) if combine else records)
+                        for run in paths[i:i+fan_in]:
+                            os.remove(run)
+                        merged.append(path)
+                    paths=merged
+                records=heapq.merge(*[read_run(run) for run in paths])
+                return(combine(records) if combine else records)
+            #records (ngram, frequency, first), where first is the number of distinct ngrams found before the ngram in the corpus, which keeps the order of exact mode
+            counted=[]
+            spilled=0
+            for tokens,weight in self.weighted_tokenized_segments(corpus,last_id):
+                count_segment_ngrams(tokens,weight,nmin,nmax,ngramsC,tokensC)
+                if len(ngramsC)>=maxngrams:
+                    write_run(new_run(),sorted([(" ".join(ng),frequency,spilled+first) for first,(ng,frequency) in enumerate(ngramsC.items())]))
+                    counted.append(runs[-1])
+                    spilled+=len(ngramsC)
+                    ngramsC=collections.Counter()
+            if len(counted)==0:
+                #nothing spilled: the counts are written as in exact mode
+                self.insert_in_batches("INSERT INTO ngrams (ngram, n, frequency) VALUES (?,?,?)",((" ".join(ng),len(ng),frequency) for ng,frequency in ngramsC.most_common() if frequency>=minfreq))
+                return(tokensC)
+            write_run(new_run(),sorted([(" ".join(ng),frequency,spilled+first) for first,(ng,frequency) in enumerate(ngramsC.items())]))
+            counted.append(runs[-1])
+            ngramsC=None
+            #records (-frequency, first, ngram), sorted by decreasing frequency and first occurrence
+            frequent=[]
+            records=[]
+            for ngram,frequency,first in merge(counted,sum_runs):
+                if frequency>=minfreq:
+                    records.append((-frequency,first,ngram))
+                    if len(records)>=maxngrams:
+                        records.sort()
+                        write_run(new_run(),records)
+                        frequent.append(runs[-1])
+                        records=[]
+            records.sort()
+            write_run(new_run(),records)
+            frequent.append(runs[-1])
+            records=None
+            self.insert_in_batches("INSERT INTO ngrams (ngram, n, frequency) VALUES (?,?,?)",((ngram,ngram.count(" ")+1,-frequency) for frequency,first,ngram in merge(frequent)))
+        return(tokensC)
+    
+    def apriori_ngram_counts(self,corpus,nmin,nmax,minfreq,last_id):
+        '''Counts the ngrams of a corpus for ngram_calculation(mode="apriori"), an order at a time: a pass counts the tokens and every following pass counts the ngrams of the next order whose prefix and suffix reached minfreq in the previous pass, stopping when none did. The orders under nmin are counted only for this pruning. Returns the Counter of the ngrams reaching minfreq, in the order of their first occurrence as counted in exact mode, and the Counter of all the tokens.'''
+        tokensC=collections.Counter()
+        #records (segment, n, position, ngram, frequency) of the ngrams reaching minfreq, sorted at the end by their first occurrence
+        found=[]
+        survivors=set()
+        for n in range(1,nmax+1):
+            if n>1 and len(survivors)==0:
+                break
+            countsC=tokensC if n==1 else collections.Counter()
+            #number of distinct ngrams counted after every segment: the keys of a Counter keep the order in which they were added, so the first segment of the ngram at a position is found by bisection
+            counted=array.array("q")
+            for tokens,weight in self.weighted_tokenized_segments(corpus,last_id):
+                if n==1:
+                    candidates=tokens
+                else:
+                    #the prefix and the suffix of the ngram starting at i are the ngrams of the previous order starting at i and i+1
+                    alive=list(map(survivors.__contains__,segment_ngrams(tokens,n-1,n-1)))
+                    candidates=itertools.compress(segment_ngrams(tokens,n,n),map(operator.and_,alive,alive[1:]))
+                if weight==1:
+                    countsC.update(candidates)
+                else:
+                    for ng in candidates:
+                        countsC[ng]+=weight
+                counted.append(len(countsC))
+            survivors=set()
+            for position,(ng,frequency) in enumerate(countsC.items()):
+                if frequency>=minfreq:
+                    if n==1:
+                        ng=(ng,)
+                    survivors.add(ng)
+                    if n>=nmin:
+                        found.append((bisect.bisect_right(counted,position),n,position,ng,frequency))
+            countsC=None
+            counted=None
+        found.sort()
+        ngramsC=collections.Counter()
+        for record in found:
+            ngramsC[record[3]]=record[4]
+        return(ngramsC,tokensC)
+    
+    #STATISTICAL TERM EXTRACTION
+    
+    def ngram_calculation (self,nmin,nmax,minfreq=2,corpus="sl_corpus",workers=None,incremental=False,mode="exact",memory_budget=268435456,sketch_error=None,sketch_confidence=0.99,temp_dir=None):
+        '''Performs the calculation of ngrams. If the corpus is sharded (see create_shards) the shards (ranges of segment ids) are counted in parallel by a pool of workers processes (by default, one per CPU). Otherwise, with workers greater than 1 the corpus is split into ranges of segment ids counted by a pool of workers processes (not for in-memory projects). The counts are merged in the order of the segments, so the result is the same as counting in a single process.
+        With incremental=True the counted segments and the counts under minfreq are recorded, so the segments added to the corpus later can be counted with update_ngrams instead of recalculating all the ngrams.
+        The mode (one of NGRAM_MODES) sets how the ngrams are counted: "exact" holds the counts of all the ngrams in memory and the other modes bound the memory used, giving the same ngrams (see sketch_ngram_counts, external_ngram_counts and apriori_ngram_counts).'''
+        if not mode in NGRAM_MODES:
+            raise Exception("Unknown ngram counting mode "+str(mode)+". Use one of "+", ".join(NGRAM_MODES))
+        if incremental and not mode=="exact":
+            raise Exception("Incremental ngram counts require mode=\"exact\"")
+        #plain Counters (a FreqDist updates much slower), with the same most_common order
+        ngramsFD=collections.Counter()
+        tokensFD=collections.Counter()
+        n_nmin=nmin
+        n_max=nmax
+        self.drop_indexes(["ngrams","tokens"])
+        self.conn.execute("DELETE FROM ngram_state")
+        self.conn.execute("DELETE FROM pending_ngrams")
+        self.conn.execute("DELETE FROM counted_multiplicities")
+        last_id=self.corpus_last_id(corpus)
+        
+        if mode=="apriori":
+            ngramsFD,tokensFD=self.apriori_ngram_counts(corpus,nmin,nmax,minfreq,last_id)
+        elif mode=="external":
+            tokensFD=self.external_ngram_counts(corpus,nmin,nmax,minfreq,last_id,memory_budget,temp_dir)
+        elif mode=="sketch":
+            ngramsFD,tokensFD=self.sketch_ngram_counts(corpus,nmin,nmax,minfreq,last_id,memory_budget,sketch_error,sketch_confidence)
+        elif len(self.get_shards(corpus))>0 or (not workers==None and workers>1 and not self.in_memory):
+            #the segments are tokenized with the source language tokenizer for both corpora; the workers read the tokens from its token store (external corpora are tokenized as they are read)
+            store=None
+            if self.get_external_corpus(corpus)==None:
+                self.build_token_store(corpus,side="sl")
+                store=self.token_store(corpus,"sl")
+            if len(self.get_shards(corpus))>0:
+                tasks=self.ngram_counting_tasks(corpus,nmin,nmax,self.get_tokenizer("sl")[0],store)
+            else:
+                #several ranges per worker, so the workers stay busy if some ranges are slower
+                tasks=self.ngram_range_tasks(corpus,nmin,nmax,self.get_tokenizer("sl")[0],workers*4,last_id,store)
+            ngramsFD,tokensFD=self.count_ngrams_parallel(tasks,workers)
+        else:
+            with self.conn:
+                for tokens,weight in self.weighted_tokenized_segments(corpus,last_id):
+                    #we DON'T calculate one order bigger in order to detect nested candidates
+                    count_segment_ngrams(tokens,weight,nmin,nmax,ngramsFD,tokensFD)
                        
         data=[]                
+        pending=[]
         for c in ngramsFD.most_common():
+            record=[]
+            record.append(" ".join(c[0]))            
+            record.append(len(c[0]))
+            record.append(c[1])   
             if c[1]>=minfreq:
-                record=[]
-                record.append(" ".join(c[0]))            
-                record.append(len(c[0]))
-                record.append(c[1])   
                 data.append(record)
+            elif incremental:
+                pending.append(record)
         with self.conn:
             self.cur.executemany("INSERT INTO ngrams (ngram, n, frequency) VALUES (?,?,?)",data) 
+            if incremental:
+                self.cur.executemany("INSERT INTO pending_ngrams (ngram, n, frequency) VALUES (?,?,?)",pending)
+                self.conn.execute("INSERT INTO ngram_state (corpus, nmin, nmax, minfreq, tokenizer, last_id) VALUES (?,?,?,?,?,?)",(corpus,nmin,nmax,minfreq,self.get_tokenizer("sl")[0],last_id))
+                self.conn.execute("INSERT INTO counted_multiplicities (id, multiplicity) SELECT id, multiplicity FROM "+corpus+" WHERE multiplicity>1 AND id<=?",(last_id,))
             self.conn.commit()
             
         data=[]                
@@ -1929,25 +3164,12 @@ class TBXTools:
             
     def statistical_term_extraction(self,minfreq=2,corpus="sl_corpus"):
         '''Performs an statistical term extraction using the extracted ngrams (ngram_calculation should be executed first). Loading stop-words is advisable. '''
+        self.drop_indexes(["term_candidates"])
         self.cur.execute("DELETE FROM term_candidates")
         self.conn.commit()
-        stopwords=[]
-        with self.conn:
-            if corpus=="sl_corpus":
-                self.cur.execute("SELECT sl_stopword FROM sl_stopwords")
-            elif corpus=="tl_corpus":
-                self.cur.execute("SELECT tl_stopword FROM tl_stopwords")
-            for s in self.cur.fetchall():
-                stopwords.append(s[0])
-                
-        inner_stopwords=[]
-        with self.conn:
-            if corpus=="sl_corpus":
-                self.cur.execute("SELECT sl_inner_stopword FROM sl_inner_stopwords")
-            elif corpus=="tl_corpus":
-                self.cur.execute("SELECT tl_inner_stopword FROM tl_inner_stopwords")
-            for s in self.cur.fetchall():
-                inner_stopwords.append(s[0])
+        side=corpus.split("_")[0]
+        stopwords=self.get_resource(side+"_stopwords")
+        inner_stopwords=self.get_resource(side+"_inner_stopwords")
         
         self.cur.execute("SELECT ngram, n, frequency FROM ngrams order by frequency desc")
         results=self.cur.fetchall()
@@ -1990,10 +3212,12 @@ class TBXTools:
         tokenizermod = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(tokenizermod)
         self.SLtokenizer=tokenizermod.Tokenizer()
+        self.SLtokenizer_name=os.path.abspath(tokenizer)
         self.specificSLtokenizer=True
         
     def unloadSLtokenizer(self):
         self.SLtokenizer=None
+        self.SLtokenizer_name=""
         self.specificSLtokenizer=False
         
     def loadTLtokenizer(self, tokenizer):
@@ -2002,42 +3226,34 @@ class TBXTools:
         tokenizermod = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(tokenizermod)
         self.TLtokenizer=tokenizermod.Tokenizer()
+        self.TLtokenizer_name=os.path.abspath(tokenizer)
         self.specificTLtokenizer=True
         
-    def unloadSLtokenizer(self):
+    def unloadTLtokenizer(self):
         self.TLtokenizer=None
+        self.TLtokenizer_name=""
         self.specificTLtokenizer=False
             
     def statistical_term_extraction_by_segment(self, segment, minlocalfreq=1, minglobalfreq=2, maxcandidates=2, nmin=1, nmax=4):
         '''Performs an statistical term extraction over a single segment using the extracted ngrams (ngram_calculation should be executed first) Loading stop-words is advisable. '''
         ngramsFD=FreqDist()
-        sl_stopword=[]
-        with self.conn:
-            self.cur.execute("SELECT sl_stopword FROM sl_stopwords")
-            for s in self.cur.fetchall():
-                sl_stopword.append(s[0])
-                
-        sl_inner_stopwords=[]
-        with self.conn:
-            self.cur.execute("SELECT sl_inner_stopword FROM sl_inner_stopwords")
-            for s in self.cur.fetchall():
-                sl_inner_stopwords.append(s[0])
+        #the stop-words of the project and the punctuation
+        sl_stopwords=self.get_resource("sl_stopwords").union(self.sl_stopwords)
+        sl_inner_stopwords=self.get_resource("sl_inner_stopwords").union(self.sl_inner_stopwords)
         
-        for n in range(nmin,nmax+1):
-            if self.specificSLtokenizer:
-                tokens=self.SLtokenizer.tokenize(segment).split()
-            else:
-                tokens=segment.split()
-            ngs=ngrams(tokens, n)
-            for ng in ngs:
-                include=True
-                
-                if ng[0].lower() in self.sl_stopwords: include=False
-                if ng[-1].lower() in self.sl_stopwords: include=False
-                for i in range(1,len(ng)):
-                    if ng[i].lower() in self.sl_inner_stopwords:
-                        include=False
-                if include: ngramsFD[" ".join(ng)]+=1
+        if self.specificSLtokenizer:
+            tokens=self.SLtokenizer.tokenize(segment).split()
+        else:
+            tokens=segment.split()
+        for ng in segment_ngrams(tokens,nmin,nmax):
+            include=True
+            
+            if ng[0].lower() in sl_stopwords: include=False
+            if ng[-1].lower() in sl_stopwords: include=False
+            for i in range(1,len(ng)):
+                if ng[i].lower() in sl_inner_stopwords:
+                    include=False
+            if include: ngramsFD[" ".join(ng)]+=1
                 
         for ng in ngramsFD.most_common():
             print(ng)
@@ -2046,6 +3262,7 @@ class TBXTools:
         '''
         Performs case normalization. If a capitalized term exists as non-capitalized, the capitalized one will be deleted and the frequency of the non-capitalized one will be increased by the frequency of the capitalized.
         '''
+        self.create_indexes("case_normalization")
         self.cur.execute("SELECT candidate,frequency FROM term_candidates order by frequency desc")
         results=self.cur.fetchall()
         auxiliar={}
@@ -2070,6 +3287,7 @@ class TBXTools:
         '''
         Performs a normalization of nested term candidates. If an n-gram candidate A is contained in a n+1 candidate B and freq(A)==freq(B) or they are close values (determined by the percent parameter, A is deleted B remains as it is)
         '''
+        self.create_indexes("nest_normalization")
         self.cur.execute("SELECT candidate,frequency,n FROM term_candidates order by frequency desc")
         results=self.cur.fetchall()
         for a in results:
@@ -2092,6 +3310,7 @@ class TBXTools:
 
     def regexp_exclusion(self,verbose=False):
         '''Deletes term candidates matching a set of regular expresions loaded with the load_sl_exclusion_regexps method.'''
+        self.create_indexes("regexp_exclusion")
         self.cur.execute("SELECT sl_exclusion_regexp FROM sl_exclusion_regexps")
         results=self.cur.fetchall()
         for r in results:
@@ -2118,17 +3337,10 @@ class TBXTools:
         '''Performs the evaluation of the term candidates using the evaluation_terms loaded with the load_evaluation_terms method.'''
         correct=0
         total=0
-        evaluation_terms=[]
-        self.cur.execute("SELECT sl_term FROM evaluation_terms")
-        results=self.cur.fetchall()
-        for r in results:
-            evaluation_terms.append(r[0])
-        tsr_terms=[]
-        self.cur.execute("SELECT term FROM tsr_terms")
-        results=self.cur.fetchall()
-        for r in results:
-            tsr_terms.append(r[0])
-        evaluation_terms.extend(self.tsr_terms)
+        #the evaluation terms and the terms found by the last tsr
+        evaluation_terms=self.get_resource("evaluation_terms").union(self.tsr_terms)
+        #the recall is given over all the evaluation terms loaded, repeated ones included
+        nevaluation_terms=self.conn.execute("SELECT count(*) FROM evaluation_terms").fetchone()[0]+len(self.tsr_terms)
         with self.conn:
             for i in range(0,iterations):
                 if order=="desc":
@@ -2154,13 +3366,14 @@ class TBXTools:
             
         try:
             precisio=100*correct/total
-            recall=100*correct/len(evaluation_terms)
+            recall=100*correct/nevaluation_terms
             f1=2*precisio*recall/(precisio+recall)
             return(limit,correct,total,precisio,recall,f1)
         except:
             return(limit,0,0,0,0,0)
 
     def association_measures(self,measure="raw_freq"):
+        self.create_indexes("association_measures")
         measurename=measure
         bigram_measures = myBigramAssocMeasures()
         trigram_measures = myTrigramAssocMeasures()
@@ -2176,10 +3389,11 @@ class TBXTools:
             aux=(s[0])
             fd_tokens[aux]+=s[1]
             
+        #segments loaded in dedup mode are repeated as many times as they were loaded
+        multiplicities=self.get_multiplicities("sl_corpus")
         textcorpus=[]
-        self.cur.execute("SELECT segment from sl_corpus")
-        for segment in self.cur.fetchall():
-            textcorpus.extend(segment[0].split())
+        for id,tokens in self.iter_tokenized_segments("sl_corpus"):
+            textcorpus.extend(tokens*multiplicities.get(id,1))
             
         bigram_finder=BigramCollocationFinder.from_words(textcorpus)
         trigram_finder=TrigramCollocationFinder.from_words(textcorpus)
@@ -2244,9 +3458,11 @@ class TBXTools:
     
 
 
+    @bulk_loader
     def index_phrase_table(self,phrasetable):
-        '''Indexes a phrase table from Moses.'''
-        self.entrada=gzip.open(phrasetable, mode='rt',encoding='utf-8')
+        '''Indexes a phrase table from Moses (plain text or compressed, see open_input).'''
+        self.drop_indexes(["index_pt"])
+        self.entrada=open_text(phrasetable)
 
         self.pt={}
         self.continserts=0
@@ -2294,7 +3510,7 @@ class TBXTools:
         result={}
         if isinstance(SLterms, str):
             if os.path.exists(SLterms):
-                entrada=codecs.open(SLterms)
+                entrada=open_text(SLterms)
                 for linia in entrada:
                     linia=linia.rstrip()
                     tofind.append(linia)
@@ -2303,11 +3519,7 @@ class TBXTools:
                 tofind.append(SLterms)
         elif isinstance(SLterms, list):
             tofind.extend(SLterms)
-        tl_stopwords=[]
-        with self.conn:
-            self.cur.execute("SELECT tl_stopword FROM tl_stopwords")
-            for s in self.cur.fetchall():
-                tl_stopwords.append(s[0])
+        tl_stopwords=self.get_resource("tl_stopwords")
        
         for SLterm in tofind:
             fd=FreqDist()
@@ -2326,64 +3538,87 @@ class TBXTools:
             nmin=nSLterm-maxdec
             if nmin<1: nmin=1
             nmax=nSLterm+maxinc
+            #parallel_corpus has no token store: the target segments found are tokenized as they are read
             for TLsegment in TLsegments:
                 if self.specificTLtokenizer:
                     TLsegmenttok=self.TLtokenizer.tokenize(TLsegment[0]).split()
                 else:
                     TLsegmenttok=TLsegment[0].split()
-                for n in range(nmin,nmax+1):
-                    ngs=ngrams(TLsegmenttok, n)
-                    for ng in ngs:
-                        include=True
-                        if ng[0] in tl_stopwords: include=False
-                        if len(ng)>1 and ng[1] in tl_stopwords: include=False
-                        if include:
-                            detokcandidate=" ".join(ng)
-                            if self.specificTLtokenizer:
-                                detokcandidate=self.TLtokenizer.detokenize(detokcandidate)
-                            fd[detokcandidate]+=1
+                for ng in segment_ngrams(TLsegmenttok,nmin,nmax):
+                    include=True
+                    if ng[0] in tl_stopwords: include=False
+                    if len(ng)>1 and ng[1] in tl_stopwords: include=False
+                    if include:
+                        detokcandidate=" ".join(ng)
+                        if self.specificTLtokenizer:
+                            detokcandidate=self.TLtokenizer.detokenize(detokcandidate)
+                        fd[detokcandidate]+=1
                             
             totalf=fd.N()            
             for mc in fd.most_common(candidates):
                 result[SLterm][mc[0]]=mc[1]/totalf
         return(result)
     
-    def compoundify_sl_corpus(self,term):
-        term2=term.replace(" ","▁")
-        self.cur.execute("SELECT id, segment FROM sl_corpus where INSTR(segment,\""+term+"\")")
-        trobats=self.cur.fetchall()
-        for trobat in trobats:
-            ident=trobat[0]
-            segment=trobat[1]
-            segment2=segment.replace(term,term2)
-            self.cur.execute("UPDATE sl_corpus SET segment=? where id=?",(segment2,ident))
-        self.conn.commit()
+    def compoundified_segments(self,corpus,terms,comp_symbol="▁"):
+        '''Yields batches (lists of (id, compoundified segment, hash)) of the segments of the corpus changed by compoundifying the given term or list of terms in a single pass. The corpus is read in batches of self.maxinserts segments up to the last id when it is called, so the segments can be updated (or new segments added) between batches.'''
+        self.check_not_external(corpus)
+        if isinstance(terms,str):
+            terms=[terms]
+        compoundifier=Compoundifier(terms,comp_symbol)
+        if compoundifier.terms==0:
+            return
+        max_id=self.conn.execute("SELECT max(id) FROM "+corpus).fetchone()[0]
+        if max_id==None:
+            return
+        sql="SELECT id, segment, hash FROM "+corpus+" WHERE id>? AND id<=?"
+        if len(terms)==1:
+            #a single term can be prefiltered by SQLite
+            sql+=" AND INSTR(segment,?)"
+        sql+=" ORDER BY id LIMIT "+str(self.maxinserts)
+        last_id=0
+        while 1:
+            if len(terms)==1:
+                segments=self.conn.execute(sql,(last_id,max_id,terms[0])).fetchall()
+            else:
+                segments=self.conn.execute(sql,(last_id,max_id)).fetchall()
+            if len(segments)==0:
+                break
+            trobats=[]
+            for ident,segment,hash in segments:
+                segment2=compoundifier.compoundify(segment)
+                if not segment2==segment:
+                    trobats.append((ident,segment2,hash))
+            if len(trobats)>0:
+                yield(trobats)
+            last_id=segments[-1][0]
     
-    def compoundify_tl_corpus(self,term):
-        term2=term.replace(" ","▁")
-        self.cur.execute("SELECT id, segment FROM tl_corpus where INSTR(segment,\""+term+"\")")
-        trobats=self.cur.fetchall()
-        for trobat in trobats:
-            ident=trobat[0]
-            segment=trobat[1]
-            segment2=segment.replace(term,term2)
-            self.cur.execute("UPDATE tl_corpus SET segment=? where id=?",(segment2,ident))
-        self.conn.commit()
+    def compoundify_corpus(self,corpus,term,comp_symbol="▁"):
+        '''Common part of compoundify_sl_corpus and compoundify_tl_corpus.'''
+        changed=False
+        for trobats in self.compoundified_segments(corpus,term,comp_symbol):
+            with self.conn:
+                #the hash of a segment loaded with dedup is recomputed; it stays empty if the compoundified segment is already in the corpus with its own hash
+                self.conn.executemany("UPDATE "+corpus+" SET segment=?, hash=NULL where id=?",[(segment2,ident) for ident,segment2,hash in trobats])
+                self.conn.executemany("UPDATE OR IGNORE "+corpus+" SET hash=? where id=?",[(segment_hash(segment2),ident) for ident,segment2,hash in trobats if not hash==None])
+                for store in self.token_stores_of(corpus):
+                    self.conn.executemany("DELETE FROM "+store+" where id=?",[(ident,) for ident,segment2,hash in trobats])
+            changed=True
+        if changed:
+            self.invalidate_counts(corpus)
     
-    def compoundify_tl_corpus_mod(self,term):
-        term2=term.replace(" ","▁")
-        self.cur.execute("SELECT id, segment FROM tl_corpus where INSTR(segment,\""+term+"\")")
-        trobats=self.cur.fetchall()
-        data=[]
-        for trobat in trobats:
-            ident=trobat[0]
-            segment=trobat[1]
-            segment2=segment.replace(term,term2)
-            data.append([segment2])
-            
-            
-        self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",data)
-        self.conn.commit()
+    def compoundify_sl_corpus(self,term,comp_symbol="▁"):
+        '''Compoundifies a term or a list of terms in the source language corpus.'''
+        self.compoundify_corpus("sl_corpus",term,comp_symbol)
+    
+    def compoundify_tl_corpus(self,term,comp_symbol="▁"):
+        '''Compoundifies a term or a list of terms in the target language corpus.'''
+        self.compoundify_corpus("tl_corpus",term,comp_symbol)
+    
+    def compoundify_tl_corpus_mod(self,term,comp_symbol="▁"):
+        '''Adds to the target language corpus a compoundified copy of the segments containing a term or a list of terms.'''
+        for trobats in self.compoundified_segments("tl_corpus",term,comp_symbol):
+            with self.conn:
+                self.cur.executemany("INSERT INTO tl_corpus (segment) VALUES (?)",[(segment2,) for ident,segment2,hash in trobats])
     
     def find_translation_comparable_corpus(self,SLterms,tl_stopwords=None,mapping_dictionary="MUSE-en-es.txt",maxdec=1,maxinc=2,candidates=25,compoundifySL=True,compoundifyTL=True,max_term_candidates_compoundify=200):
         tofind=[]
@@ -2391,7 +3626,7 @@ class TBXTools:
         
         if isinstance(SLterms, str):
             if os.path.exists(SLterms):
-                entrada=codecs.open(SLterms)
+                entrada=open_text(SLterms)
                 for linia in entrada:
                     linia=linia.rstrip()
                     tofind.append(linia)
@@ -2403,18 +3638,21 @@ class TBXTools:
         #compoundify SL corpus
         slnmin=1000000
         slnmax=0
+        compoundify_terms=[]
         for SLterm in tofind:
             if self.specificSLtokenizer:
                 termtok=self.SLtokenizer.tokenize(SLterm)
             else:
                 termtok=SLterm
             if len(termtok.split())>1 and compoundifySL:
-                self.compoundify_sl_corpus(SLterm)
+                compoundify_terms.append(SLterm)
             if len(termtok.split())<slnmin:slnmin=len(termtok.split())
             if len(termtok.split())>slnmax:slnmax=len(termtok.split())
             n_min=slnmin-maxdec
             if n_min<2: n_min=2
             n_max=slnmax+maxdec
+        if len(compoundify_terms)>0:
+            self.compoundify_sl_corpus(compoundify_terms)
         #compoundify TL corpus  (basic statistical term extraction)
         if compoundifyTL:
             self.delete_tokens()
@@ -2428,10 +3666,10 @@ class TBXTools:
                 self.load_tl_stopwords(tl_stopwords)
             self.statistical_term_extraction(minfreq=2,corpus="tl_corpus")
             self.cur.execute("SELECT candidate FROM term_candidates ORDER BY frequency desc limit "+str(max_term_candidates_compoundify)+";")
-            trobats=self.cur.fetchall()
-            for trobat in trobats:
-                term=trobat[0]
-                self.compoundify_tl_corpus(term)
+            compoundify_terms=[]
+            for trobat in self.cur.fetchall():
+                compoundify_terms.append(trobat[0])
+            self.compoundify_tl_corpus(compoundify_terms)
         print("CALCULATING EMBEDDINGS SL")
         self.calculate_embeddings_sl("embeddingsSL.temp",vector_size=300, window=5)
         print("CALCULATING EMBEDDINGS TL")
@@ -2440,11 +3678,7 @@ class TBXTools:
         self.mapEmbeddings("embeddingsSL.temp","embeddingsTL.temp","mappedSL.tmp","mappedTL.tmp",mapping_dictionary)        
         self.load_SL_embeddings("mappedSL.tmp")
         self.load_TL_embeddings("mappedTL.tmp")
-        stopwords=[]
-        with self.conn:
-            self.cur.execute("SELECT tl_stopword FROM tl_stopwords")
-            for s in self.cur.fetchall():
-                stopwords.append(s[0])
+        stopwords=self.get_resource("tl_stopwords")
         results={}
         for SLterm in tofind:
             if self.specificSLtokenizer:
@@ -2477,23 +3711,24 @@ class TBXTools:
     
     def find_translation_ptable(self,sourceterm,maxdec=1,maxinc=1,ncandidates=5,separator=":"):
         '''Finds translation equivalents in an indexed phrase table table. Requires an indexed phrase table and a a list of terms separated by ":".
-        The number of translation candidates can be fixed, as well as the maximum decrement and increment of the number of tokens of the translation candidate'''
+        The number of translation candidates can be fixed, as well as the maximum decrement and increment of the number of tokens of the translation candidate. It can be called from several threads at the same time.'''
+        if self.is_writer_thread():
+            self.create_indexes("find_translation_ptable")
         #select target from index_pt where source="international conflict";
-        self.cur.execute('SELECT target,probability FROM index_pt where source =?',(sourceterm,))
-        self.results=self.cur.fetchall()
-        self.targetcandidates={}
-        for self.a in self.results:
-            self.targetterm=self.a[0]
-            self.probability=float(self.a[1])
-            self.tttokens=self.targetterm.split()
+        results=self.get_reader().execute('SELECT target,probability FROM index_pt where source =?',(sourceterm,)).fetchall()
+        targetcandidates={}
+        for a in results:
+            targetterm=a[0]
+            probability=float(a[1])
+            tttokens=targetterm.split()
             
-            if not self.tttokens[0] in self.tl_stopwords and not self.tttokens[-1] in self.tl_stopwords and len(self.tttokens)>=len(sourceterm.split())-maxdec and len(self.tttokens)<=len(sourceterm.split())+maxinc:
-                self.targetcandidates[self.targetterm]=self.probability
-        self.sorted_x = sorted(self.targetcandidates.items(), key=operator.itemgetter(1),reverse=True)
-        self.results=[]
-        for self.s in self.sorted_x:
-            self.results.append(self.s[0].replace(":",";"))
-        return(separator.join(self.results[0:ncandidates]))
+            if not tttokens[0] in self.tl_stopwords and not tttokens[-1] in self.tl_stopwords and len(tttokens)>=len(sourceterm.split())-maxdec and len(tttokens)<=len(sourceterm.split())+maxinc:
+                targetcandidates[targetterm]=probability
+        sorted_x = sorted(targetcandidates.items(), key=operator.itemgetter(1),reverse=True)
+        results=[]
+        for s in sorted_x:
+            results.append(s[0].replace(":",";"))
+        return(separator.join(results[0:ncandidates]))
         
                 
    
@@ -2544,12 +3779,13 @@ class TBXTools:
     def tag_freeling_api(self,corpus="source"):
         with self.conn:
             data=[]
+            #the segments of sl_corpus and tl_corpus can come from an external corpus
             if corpus=="source":
-                self.cur.execute('SELECT id,segment from sl_corpus')
+                segments=self.iter_segments("sl_corpus")
             elif corpus=="target":
-                self.cur.execute('SELECT id,segment from tl_corpus')
+                segments=self.iter_segments("tl_corpus")
             continserts=0
-            for s in self.cur.fetchall():
+            for s in segments:
                 id=s[0]
                 segment=s[1]
                 continserts+=1
@@ -2582,6 +3818,10 @@ class TBXTools:
                     self.cur.executemany("INSERT INTO sl_tagged_corpus (id, tagged_segment) VALUES (?,?)",data) 
                 if corpus=="target":
                     self.cur.executemany("INSERT INTO tl_tagged_corpus (id, tagged_segment) VALUES (?,?)",data)
+        if corpus=="source":
+            self.copy_multiplicities("sl_corpus","sl_tagged_corpus")
+        elif corpus=="target":
+            self.copy_multiplicities("tl_corpus","tl_tagged_corpus")
     
     
     #SPACY TAGGER
@@ -2601,15 +3841,15 @@ class TBXTools:
         with self.conn:
             data=[]
             if corpus=="source":
-                self.cur.execute('SELECT id,segment from sl_corpus')
+                segments=self.iter_segments("sl_corpus")
             elif corpus=="target":
-                self.cur.execute('SELECT id,segment from tl_corpus')
+                segments=self.iter_segments("tl_corpus")
             elif corpus=="parallel-source":
-                self.cur.execute('SELECT id,segmentSL from parallel_corpus')
+                segments=self.conn.execute('SELECT id,segmentSL from parallel_corpus').fetchall()
             elif corpus=="parallel-target":
-                self.cur.execute('SELECT id,segmentTL from parallel_corpus')
+                segments=self.conn.execute('SELECT id,segmentTL from parallel_corpus').fetchall()
             continserts=0
-            for s in self.cur.fetchall():
+            for s in segments:
                 id=s[0]
                 segment=s[1]
                 continserts+=1
@@ -2648,6 +3888,10 @@ class TBXTools:
                     self.cur.executemany("INSERT INTO tagged_parallel_corpus (id, tagged_segmentSL) VALUES (?,?) ON CONFLICT (id) DO UPDATE  SET tagged_segmentSL=excluded.tagged_segmentSL",data)
                 elif corpus=="parallel-target":
                     self.cur.executemany("INSERT INTO tagged_parallel_corpus (id, tagged_segmentTL) VALUES (?,?) ON CONFLICT (id) DO UPDATE SET tagged_segmentTL=excluded.tagged_segmentTL",data)
+        if corpus=="source":
+            self.copy_multiplicities("sl_corpus","sl_tagged_corpus")
+        elif corpus=="target":
+            self.copy_multiplicities("tl_corpus","tl_tagged_corpus")
     
     #SPACY_UDPIPE TAGGER
     def load_POS_model_spacy_udpipe(self, language):
@@ -2668,15 +3912,15 @@ class TBXTools:
         with self.conn:
             data=[]
             if corpus=="source":
-                self.cur.execute('SELECT id,segment from sl_corpus')
+                segments=self.iter_segments("sl_corpus")
             elif corpus=="target":
-                self.cur.execute('SELECT id,segment from tl_corpus')
+                segments=self.iter_segments("tl_corpus")
             elif corpus=="parallel-source":
-                self.cur.execute('SELECT id,segmentSL from parallel_corpus')
+                segments=self.conn.execute('SELECT id,segmentSL from parallel_corpus').fetchall()
             elif corpus=="parallel-target":
-                self.cur.execute('SELECT id,segmentTL from parallel_corpus')
+                segments=self.conn.execute('SELECT id,segmentTL from parallel_corpus').fetchall()
             continserts=0
-            for s in self.cur.fetchall():
+            for s in segments:
                 id=s[0]
                 segment=s[1]
                 continserts+=1
@@ -2706,13 +3950,17 @@ class TBXTools:
                     continserts=0
             with self.conn:
                 if corpus=="source":
-                    self.cur.executemany("INSERT sl_tagged_corpus (id, tagged_segment) VALUES (?,?)",data) 
+                    self.cur.executemany("INSERT INTO sl_tagged_corpus (id, tagged_segment) VALUES (?,?)",data) 
                 elif corpus=="target":
                     self.cur.executemany("INSERT INTO tl_tagged_corpus (id, tagged_segment) VALUES (?,?)",data)
                 elif corpus=="parallel-source":
                     self.cur.executemany("INSERT INTO tagged_parallel_corpus (id, tagged_segmentSL) VALUES (?,?) ON CONFLICT (id) DO UPDATE  SET tagged_segmentSL=excluded.tagged_segmentSL",data)
                 elif corpus=="parallel-target":
                     self.cur.executemany("INSERT INTO tagged_parallel_corpus (id, tagged_segmentTL) VALUES (?,?) ON CONFLICT (id) DO UPDATE SET tagged_segmentTL=excluded.tagged_segmentTL",data)
+        if corpus=="source":
+            self.copy_multiplicities("sl_corpus","sl_tagged_corpus")
+        elif corpus=="target":
+            self.copy_multiplicities("tl_corpus","tl_tagged_corpus")
     
     
     def save_sl_tagged_corpus(self,outputfile,encoding="utf-8"):
@@ -2746,21 +3994,27 @@ class TBXTools:
             sortida.write(tagged_segment+"\n")
 
     
-    def tagged_ngram_calculation (self,nmin=2,nmax=3,minfreq=2):
-        '''Calculates the tagged ngrams.'''
-        ngramsFD=FreqDist()
+    def tagged_ngram_calculation (self,nmin=2,nmax=3,minfreq=2,workers=None):
+        '''Calculates the tagged ngrams. If the tagged corpus is sharded (see create_shards) the shards (ranges of segment ids) are counted in parallel by a pool of workers processes (by default, one per CPU). Otherwise, with workers greater than 1 the tagged corpus is split into ranges of segment ids counted by a pool of workers processes (see ngram_calculation).'''
+        self.drop_indexes(["tagged_ngrams"])
+        #plain Counters (a FreqDist updates much slower), with the same most_common order
+        ngramsFD=collections.Counter()
         n_nmin=nmin
         n_max=nmax
         data=[]
         record=[]
-        with self.conn:
-            self.cur.execute('SELECT tagged_segment from sl_tagged_corpus')
-            for s in self.cur.fetchall():
-                segment=s[0]
-                for n in range(nmin,nmax+1):
-                    ngs=ngrams(segment.split(),n)
-                    for ng in ngs:
-                        ngramsFD[ng]+=1
+        if len(self.get_shards("sl_tagged_corpus"))>0:
+            tasks=self.ngram_counting_tasks("sl_tagged_corpus",nmin,nmax,"")
+            ngramsFD,tokensFD=self.count_ngrams_parallel(tasks,workers)
+        elif not workers==None and workers>1 and not self.in_memory:
+            tasks=self.ngram_range_tasks("sl_tagged_corpus",nmin,nmax,"",workers*4,self.corpus_last_id("sl_tagged_corpus"))
+            ngramsFD,tokensFD=self.count_ngrams_parallel(tasks,workers)
+        else:
+            with self.conn:
+                self.cur.execute('SELECT tagged_segment, multiplicity from sl_tagged_corpus')
+                for s in self.cur.fetchall():
+                    for ng in segment_ngrams(s[0].split(),nmin,nmax):
+                        ngramsFD[ng]+=s[1]
         for c in ngramsFD.most_common():
            if c[1]>=minfreq:
                 candidate=[]
@@ -2798,7 +4052,7 @@ class TBXTools:
     
     def load_linguistic_patterns(self,file, encoding="utf-8"):
         '''Loads the linguistic patterns to use with linguistic terminology extraction.'''
-        entrada=codecs.open(file,"r",encoding=encoding)
+        entrada=open_text(file,encoding=encoding)
         linguistic_patterns=[]
         data=[]
         record=[]
@@ -2821,6 +4075,7 @@ class TBXTools:
     
     def linguistic_term_extraction(self,minfreq=2):
         '''Performs an linguistic term extraction using the extracted tagged ngrams (tagged_ngram_calculation should be executed first). '''
+        self.drop_indexes(["term_candidates"])
         linguistic_patterns=[]
         controlpatterns=[]
         with self.conn:
@@ -2892,6 +4147,7 @@ class TBXTools:
             self.conn.commit()
             
     def learn_linguistic_patterns(self,outputfile,showfrequencies=False,encoding="utf-8",verbose=True,representativity=100):
+        self.create_indexes("learn_linguistic_patterns")
         learntpatterns={}
         sortida=codecs.open(outputfile,"w",encoding=encoding)
         acufreq=0
@@ -2952,20 +4208,17 @@ class TBXTools:
         self.nmin=len(slterm.split())-maxdec
         self.nmax=len(slterm.split())+maxinc
         self.tlngrams=FreqDist()
+        self.build_token_store("tl_corpus")
         with self.conn:
-            self.cur.execute('SELECT id, segment from sl_corpus')
-            
-            for self.s in self.cur.fetchall():
+            for self.s in self.iter_segments("sl_corpus"):
                 self.segment=self.s[1]
                 self.id=self.s[0]
                 
                 if self.segment.find(slterm)>-1:
-                    self.cur2.execute('SELECT segment from tl_corpus where id="'+str(self.id)+'"')
-                    for self.s2 in self.cur2.fetchall():
-                        self.tl_segment=self.s2[0]
+                    self.tl_tokens=self.get_tokenized_segment("tl_corpus",self.id)
+                    if len(self.tl_tokens)>0:
                         for self.n in range(self.nmin,self.nmax+1):
-                            #self.tlngs=ngrams(self.tl_tokenizer.tokenize(self.tl_segment), self.n)
-                            self.tlngs=ngrams(self.tl_segment.split(), self.n)
+                            self.tlngs=ngrams(self.tl_tokens, self.n)
                             for self.tlng in self.tlngs:
                                 if not self.tlng[0] in self.tl_stopwords and not self.tlng[-1] in self.tl_stopwords:
                                     self.tlngrams[self.tlng]+=1
@@ -2979,20 +4232,17 @@ class TBXTools:
         self.nmin=len(slterm.split())-maxdec
         self.nmax=len(slterm.split())+maxinc
         self.tlngrams=FreqDist()
+        self.build_token_store("tl_corpus")
         with self.conn:
-            self.cur.execute('SELECT id, segment from sl_corpus')
-            
-            for self.s in self.cur.fetchall():
+            for self.s in self.iter_segments("sl_corpus"):
                 self.segment=self.s[1]
                 self.id=self.s[0]
                 
                 if self.segment.find(slterm)>-1:
-                    self.cur2.execute('SELECT segment from tl_corpus where id="'+str(self.id)+'"')
-                    for self.s2 in self.cur2.fetchall():
-                        self.tl_segment=self.s2[0]
+                    self.tl_tokens=self.get_tokenized_segment("tl_corpus",self.id)
+                    if len(self.tl_tokens)>0:
                         for self.n in range(self.nmin,self.nmax+1):
-                            #self.tlngs=ngrams(self.tl_tokenizer.tokenize(self.tl_segment), self.n)
-                            self.tlngs=ngrams(self.tl_segment.split(), self.n)
+                            self.tlngs=ngrams(self.tl_tokens, self.n)
                             for self.tlng in self.tlngs:
                                 if not self.tlng[0] in self.tl_stopwords and not self.tlng[-1] in self.tl_stopwords:
                                     self.tlngrams[self.tlng]+=1
@@ -3005,43 +4255,23 @@ class TBXTools:
 #EMBEDDINGS
 
     def calculate_embeddings_sl(self,filename,vector_size=300, window=5, min_count=1, workers=4):
-        self.cur.execute('SELECT id, segment from sl_corpus')
         data = []
-        for s in self.cur.fetchall():
-            temp=[]
-            segment=s[1] 
-            if self.specificSLtokenizer:
-                tokens=self.SLtokenizer.tokenize(segment).split()
-            else:
-                tokens=segment.split()
+        for id,tokens in self.iter_tokenized_segments("sl_corpus"):
             data.append(tokens)
         model = Word2Vec(sentences=data, vector_size=vector_size, window=window, min_count=min_count, workers=workers)
         model.wv.save_word2vec_format(filename, binary=False)
      
     def calculate_embeddings_sl_ref(self,filename,vector_size=300, window=5, min_count=1, workers=4):
-        self.cur.execute('SELECT id, segment from tl_corpus')
         data = []
-        for s in self.cur.fetchall():
-            temp=[]
-            segment=s[1] 
-            if self.specificSLtokenizer:
-                tokens=self.SLtokenizer.tokenize(segment).split()                
-            else:
-                tokens=segment.split()
+        #the reference corpus is stored in tl_corpus but it is in the source language
+        for id,tokens in self.iter_tokenized_segments("tl_corpus",side="sl"):
             data.append(tokens)
         model = Word2Vec(sentences=data, vector_size=vector_size, window=window, min_count=min_count, workers=workers)
         model.wv.save_word2vec_format(filename, binary=False)
     
     def calculate_embeddings_tl(self,filename,vector_size=300, window=5, min_count=1, workers=4):
-        self.cur.execute('SELECT id, segment from tl_corpus')
         data = []
-        for s in self.cur.fetchall():
-            temp=[]
-            segment=s[1] 
-            if self.specificTLtokenizer:
-                tokens=self.TLtokenizer.tokenize(segment).split()
-            else:
-                tokens=segment.split()
+        for id,tokens in self.iter_tokenized_segments("tl_corpus"):
             data.append(tokens)
         model = Word2Vec(sentences=data, vector_size=vector_size, window=window, min_count=min_count, workers=workers)
         model.wv.save_word2vec_format(filename, binary=False)
@@ -3392,6 +4622,253 @@ class TBXTools:
             
         self.conn.commit()   
 
+def bounded_map(executor,function,iterable,inflight=None):
+    '''Like executor.map but submitting at most inflight tasks (by default, twice the number of workers) ahead of the results consumed, so the input is read as a stream. Results are yielded in order.'''
+    if inflight==None:
+        inflight=2*getattr(executor,"_max_workers",os.cpu_count() or 1)
+    futures=collections.deque()
+    for item in iterable:
+        futures.append(executor.submit(function,item))
+        if len(futures)>=inflight:
+            yield(futures.popleft().result())
+    while len(futures)>0:
+        yield(futures.popleft().result())
+
+#state of the worker processes of the directory loaders
+worker_compoundifier=None
+worker_tokenizers={}
+
+def init_corpus_worker(compoundifier):
+    '''Initializes a worker process of the directory loaders with the Compoundifier to apply (None for no compoundification).'''
+    global worker_compoundifier
+    worker_compoundifier=compoundifier
+
+def worker_tokenizer(tokenizer):
+    '''Returns the tokenization function of a tokenizer (see load_tokenizer), loading it once per worker process.'''
+    if not tokenizer in worker_tokenizers:
+        worker_tokenizers[tokenizer]=load_tokenizer(tokenizer)
+    return(worker_tokenizers[tokenizer])
+
+def read_monolingual_file(task):
+    '''Reads a monolingual corpus file for TBXTools.load_sl_corpus_dir and load_tl_corpus_dir. The task is a tuple (file, encoding, tokenizers), where tokenizers is None or a tuple with the tokenizer of the corpus. Returns (file, segments, tokens) (see TBXTools.corpus_file_batches).'''
+    path,encoding,tokenizers=task
+    rows=[]
+    tokens=None
+    cf=open_text(path,encoding=encoding,errors="ignore")
+    try:
+        for line in cf:
+            line=line.rstrip()
+            if not worker_compoundifier==None:
+                line=worker_compoundifier.compoundify(line)
+            rows.append((line,))
+    finally:
+        cf.close()
+    if not tokenizers==None:
+        tokenize=worker_tokenizer(tokenizers[0])
+        tokens=[]
+        for row in rows:
+            tokens.append((tokenize(row[0]),))
+    return(path,rows,tokens)
+
+def read_parallel_file(task):
+    '''Reads a parallel corpus file (TMX or tab separated text) for TBXTools.load_parallel_corpus_dir. The task is a tuple (file, format, encoding, source language codes, target language codes, tokenizers), where tokenizers is None or a tuple with the source and target tokenizers. Returns (file, pairs, tokens) (see TBXTools.corpus_file_batches).'''
+    path,format,encoding,slcodes,tlcodes,tokenizers=task
+    rows=[]
+    tokens=None
+    if format=="tmx":
+        for pair in iter_tmx_pairs(path,slcodes,tlcodes):
+            rows.append(pair)
+    else:
+        cf=open_text(path,encoding=encoding)
+        try:
+            for linia in cf:
+                camps=linia.rstrip().split("\t")
+                if len(camps)>=2:
+                    rows.append((camps[0].rstrip(),camps[1].rstrip()))
+        finally:
+            cf.close()
+    if not tokenizers==None:
+        sltokenize=worker_tokenizer(tokenizers[0])
+        tltokenize=worker_tokenizer(tokenizers[1])
+        tokens=[]
+        for row in rows:
+            tokens.append((sltokenize(row[0]),tltokenize(row[1])))
+    return(path,rows,tokens)
+
+def sdltm_segment_text(segmentxml):
+    '''Returns the text of the segment XML of a SDLTM translation unit (the text of its last Value element, "" if it has none).'''
+    text=""
+    for value in etree.fromstring(segmentxml).iter('Value'):
+        text="".join(value.itertext()).replace("\n"," ")
+    return(text)
+
+def parse_sdltm_units(rows):
+    '''Parses a batch of (source segment XML, target segment XML) rows of a SDLTM memory. Returns the list of (source text, target text) pairs, the number of rows that couldn't be parsed and the number of rows with an empty side. It is run by the worker processes of TBXTools.load_parallel_corpus_sdltm.'''
+    parsed=[]
+    errors=0
+    empty=0
+    for ssxml,tsxml in rows:
+        try:
+            sltext=sdltm_segment_text(ssxml)
+            tltext=sdltm_segment_text(tsxml)
+        except Exception:
+            errors+=1
+            continue
+        if not sltext=="" and not tltext=="":
+            parsed.append((sltext,tltext))
+        else:
+            empty+=1
+    return(parsed,errors,empty)
+
+def load_tokenizer(tokenizer):
+    '''Returns the tokenization function (segment -> list of tokens) of the tokenizer plugin in the given path ("" for whitespace tokenization).'''
+    if tokenizer=="":
+        return(str.split)
+    spec = importlib.util.spec_from_file_location('', tokenizer)
+    tokenizermod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tokenizermod)
+    plugin=tokenizermod.Tokenizer()
+    return(lambda segment: plugin.tokenize(segment).split())
+
+def segment_ngrams(tokens,nmin,nmax):
+    '''Returns an iterator over the ngrams (tuples of tokens) of orders nmin to nmax of a tokenized segment, order by order and in the order of the segment, as nltk.util.ngrams for every order. All the orders are sliding windows over the same list of tokens, so the segment is tokenized only once.'''
+    return(itertools.chain.from_iterable(zip(*[itertools.islice(tokens,i,None) for i in range(n)]) for n in range(max(nmin,1),nmax+1)))
+
+def count_segment_ngrams(tokens,weight,nmin,nmax,ngramsC,tokensC):
+    '''Adds to the Counters (or FreqDists) ngramsC and tokensC the ngrams of orders nmin to nmax and the tokens of a segment, weighted by its multiplicity.'''
+    if weight==1:
+        ngramsC.update(segment_ngrams(tokens,nmin,nmax))
+    else:
+        for ng in segment_ngrams(tokens,nmin,nmax):
+            ngramsC[ng]+=weight
+    if weight==1:
+        tokensC.update(tokens)
+    else:
+        for token in tokens:
+            tokensC[token]+=weight
+
+#ngrams hashed at a time by the approximate counting of ngram_calculation (mode="sketch")
+SKETCH_BATCH_SIZE=1048576
+
+class CountMinSketch:
+    '''Count-min sketch: depth rows of width counters. Every item is added to one counter per row, chosen by double hashing of its 64-bit hash, and its estimate is the minimum of its counters. Estimates are never lower than the true counts and, with probability 1-delta, at most epsilon*N higher (N being the total count added) if width>=e/epsilon and depth>=ln(1/delta).'''
+    def __init__(self,width,depth):
+        self.width=width
+        self.depth=depth
+        self.counts=np.zeros((depth,width),dtype=np.uint64)
+        self.total=0
+    
+    def indexes(self,hashes):
+        '''Returns the counter of every row (an array of depth rows) for an array of int64 hashes.'''
+        hashes=hashes.view(np.uint64)
+        h1=hashes&np.uint64(0xFFFFFFFF)
+        h2=(hashes>>np.uint64(32))|np.uint64(1)
+        rows=[]
+        for i in range(self.depth):
+            rows.append((h1+np.uint64(i)*h2)%np.uint64(self.width))
+        return(rows)
+    
+    def add(self,hashes,weights):
+        '''Adds the weights (an array of uint64) to the items with the given hashes (an array of int64).'''
+        for i,row in enumerate(self.indexes(hashes)):
+            np.add.at(self.counts[i],row,weights)
+        self.total+=int(weights.sum())
+    
+    def estimate(self,hashes):
+        '''Returns the estimated counts of the items with the given hashes (an array of int64).'''
+        estimates=None
+        for i,row in enumerate(self.indexes(hashes)):
+            if estimates is None:
+                estimates=self.counts[i][row]
+            else:
+                estimates=np.minimum(estimates,self.counts[i][row])
+        return(estimates)
+
+#maximum number of runs merged at a time by the external counting of ngram_calculation (fewer if a block of every run doesn't fit in the memory budget)
+MERGE_FAN_IN=64
+
+#bytes taken by every distinct ngram held in memory by the external counting of ngram_calculation (mode="external"): about 120 for a Counter entry with its tuple key and about 150 for its record while the Counter is spilled to a run
+EXTERNAL_NGRAM_BYTES=300
+
+#records pickled at a time in the runs of the external counting of ngram_calculation
+RUN_BLOCK_SIZE=4096
+
+def write_run(path,records):
+    '''Writes the records of a run of the external counting of ngrams, pickled in blocks of RUN_BLOCK_SIZE records.'''
+    with open(path,"wb") as output:
+        block=[]
+        for record in records:
+            block.append(record)
+            if len(block)==RUN_BLOCK_SIZE:
+                pickle.dump(block,output,pickle.HIGHEST_PROTOCOL)
+                block=[]
+        pickle.dump(block,output,pickle.HIGHEST_PROTOCOL)
+
+def read_run(path):
+    '''Yields the records of a run written by write_run.'''
+    with open(path,"rb") as entrada:
+        while True:
+            block=pickle.load(entrada)
+            yield from block
+            if len(block)<RUN_BLOCK_SIZE:
+                break
+
+def sum_runs(records):
+    '''Adds up the frequencies of the consecutive records (ngram, frequency, first) of the same ngram, keeping the first occurrence, for records merged from runs sorted by ngram.'''
+    current=None
+    for ngram,frequency,first in records:
+        if current==ngram:
+            total+=frequency
+            earliest=min(earliest,first)
+        else:
+            if not current==None:
+                yield((current,total,earliest))
+            current,total,earliest=ngram,frequency,first
+    if not current==None:
+        yield((current,total,earliest))
+
+#vocabulary of the token store loaded by a worker process of count_ngrams_task: (database, number of tokens, list of tokens)
+worker_vocabularies=None
+
+def worker_vocabulary(conn,database):
+    '''Returns the vocabulary (id -> token) of the token store of the database, loading it once per worker process (and again if it has grown).'''
+    global worker_vocabularies
+    size=conn.execute("SELECT count(*) FROM vocabulary").fetchone()[0]
+    if worker_vocabularies==None or not worker_vocabularies[0]==database or not worker_vocabularies[1]==size:
+        worker_vocabularies=(database,size,[s[0] for s in conn.execute("SELECT token FROM vocabulary ORDER BY id")])
+    return(worker_vocabularies[2])
+
+def count_ngrams_task(task):
+    '''Counts the ngrams of orders nmin to nmax and the tokens of the segments (weighted by their multiplicity) of a corpus table with ids between first_id and last_id. The task is a tuple (database, corpus, first_id, last_id, nmin, nmax, tokenizer, store). If the corpus is an external corpus of the database, the segments are read from its file; if store is the name of a token store of the database, the tokens are read from it; otherwise the segments are tokenized with the tokenizer. It is run by the worker processes of TBXTools.count_ngrams_parallel.'''
+    database,corpus,first_id,last_id,nmin,nmax,tokenizer,store=task
+    tokenize=load_tokenizer(tokenizer)
+    ngramsC=collections.Counter()
+    tokensC=collections.Counter()
+    conn=sqlite3.connect("file:"+pathname2url(os.path.abspath(database))+"?mode=ro",uri=True)
+    try:
+        external=None
+        if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='external_corpora'").fetchone():
+            external=conn.execute("SELECT path, line_lengths, encoding FROM external_corpora WHERE corpus=?",(corpus,)).fetchone()
+        if not external==None:
+            external=ExternalCorpus(*external)
+            try:
+                for id,segment in external.iter_segments(first_id-1):
+                    if id>last_id:
+                        break
+                    count_segment_ngrams(tokenize(segment),1,nmin,nmax,ngramsC,tokensC)
+            finally:
+                external.close()
+        elif not store==None:
+            vocabulary=worker_vocabulary(conn,database)
+            for s in conn.execute("SELECT t.token_ids, c.multiplicity FROM "+corpus+" c JOIN "+store+" t ON c.id=t.id WHERE c.id BETWEEN ? AND ? ORDER BY c.id",(first_id,last_id)):
+                count_segment_ngrams([vocabulary[i] for i in np.frombuffer(s[0],dtype="<u4").tolist()],s[1],nmin,nmax,ngramsC,tokensC)
+        else:
+            for s in conn.execute("SELECT "+CORPUS_COLUMNS[corpus]+", multiplicity FROM "+corpus+" WHERE id BETWEEN ? AND ? ORDER BY id",(first_id,last_id)):
+                count_segment_ngrams(tokenize(s[0]),s[1],nmin,nmax,ngramsC,tokensC)
+    finally:
+        conn.close()
+    return(ngramsC,tokensC)
+
 def L_LLR(a,b,c):
     '''Auxiliar function to calculate Log Likelihood Ratio'''
     L=(c**a)*((1-c)**(b-a))
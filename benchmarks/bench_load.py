@@ -0,0 +1,65 @@
+#    TBXTools benchmark: corpus loading with and without the SQLite performance profile.
+#    Usage: python benchmarks/bench_load.py [number_of_segments]
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from TBXTools import TBXTools
+
+#profile equivalent to a plain sqlite3.connect (the behaviour before the performance profile)
+LEGACY_PRAGMAS={"journal_mode":"DELETE","synchronous":"FULL","cache_size":-2000,"mmap_size":0,"temp_store":"DEFAULT"}
+
+def synthetic_corpus(path,nsegments,seed=0):
+    rnd=random.Random(seed)
+    vocabulary=["w"+str(i) for i in range(20000)]
+    with open(path,"w",encoding="utf-8") as output:
+        for i in range(nsegments):
+            output.write(" ".join(rnd.choice(vocabulary) for j in range(rnd.randint(5,30)))+"\n")
+
+def synthetic_tmx(path,nsegments,seed=0):
+    rnd=random.Random(seed)
+    vocabulary=["w"+str(i) for i in range(20000)]
+    with open(path,"w",encoding="utf-8") as output:
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n<tmx version="1.4"><header srclang="en"/><body>\n')
+        for i in range(nsegments):
+            sl=" ".join(rnd.choice(vocabulary) for j in range(rnd.randint(5,30)))
+            tl=" ".join(rnd.choice(vocabulary) for j in range(rnd.randint(5,30)))
+            output.write('<tu><tuv xml:lang="en"><seg>'+sl+'</seg></tuv><tuv xml:lang="es"><seg>'+tl+'</seg></tuv></tu>\n')
+        output.write("</body></tmx>\n")
+
+def timed_load(workdir,corpus,tmx,legacy,repetitions=3):
+    times=[]
+    for r in range(repetitions):
+        project=os.path.join(workdir,"bench.sqlite")
+        extractor=TBXTools()
+        if legacy:
+            extractor.pragmas=dict(LEGACY_PRAGMAS)
+            extractor.bulk_synchronous="FULL"
+        extractor.create_project(project,overwrite=True)
+        start=time.perf_counter()
+        extractor.load_sl_corpus(corpus)
+        extractor.load_tl_corpus(corpus)
+        extractor.load_parallel_corpus_tmx(tmx,sl_code="en",tl_code="es")
+        times.append(time.perf_counter()-start)
+        extractor.conn.close()
+    return(min(times))
+
+if __name__=="__main__":
+    nsegments=int(sys.argv[1]) if len(sys.argv)>1 else 200000
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus=os.path.join(workdir,"corpus.txt")
+        tmx=os.path.join(workdir,"corpus.tmx")
+        synthetic_corpus(corpus,nsegments)
+        synthetic_tmx(tmx,nsegments)
+        #sl_corpus, tl_corpus and the TMX (parallel_corpus plus both monolingual tables)
+        loaded=5*nsegments
+        before=timed_load(workdir,corpus,tmx,legacy=True)
+        after=timed_load(workdir,corpus,tmx,legacy=False)
+        print("rows loaded:",loaded)
+        print("legacy profile:      %.2f s (%.0f rows/s)" % (before,loaded/before))
+        print("performance profile: %.2f s (%.0f rows/s)" % (after,loaded/after))
+        print("speedup: %.2fx" % (before/after))
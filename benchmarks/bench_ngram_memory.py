@@ -0,0 +1,72 @@
+#    TBXTools benchmark: peak memory of ngram_calculation counting all the ngrams in memory (mode="exact")
+#    against spilling the counts to sorted runs on disk under a memory budget (mode="external") and counting
+#    an order at a time only the ngrams whose prefix and suffix reached minfreq (mode="apriori").
+#    Usage: python benchmarks/bench_ngram_memory.py [number_of_segments ...]
+#    Every measure runs in a fresh process so its peak RSS is measured on its own. The SQLite page cache is
+#    limited to 16 MB and mmap is disabled, as otherwise the cache of the performance profile is also counted
+#    in the RSS. The peak RSS is given above the RSS of the process before counting (the imported modules and
+#    the open project). It is read from /proc/self/status (Linux), as ru_maxrss would also count the RSS of the
+#    parent process when it was forked. All the modes must give the same ngrams.
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from bench_load import synthetic_corpus
+
+#memory budget of the external mode, in bytes
+BUDGET=32*1048576
+
+def memory_status(field):
+    '''Returns a memory field of /proc/self/status in kilobytes.'''
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field+":"):
+                return(int(line.split()[1]))
+
+def measure(mode,project):
+    from TBXTools import TBXTools
+    extractor=TBXTools()
+    extractor.pragmas.update({"cache_size":-16384,"mmap_size":0})
+    extractor.open_project(project)
+    extractor.delete_ngrams()
+    before=memory_status("VmRSS")
+    start=time.perf_counter()
+    extractor.ngram_calculation(1,5,2,mode=mode,memory_budget=BUDGET)
+    elapsed=time.perf_counter()-start
+    ngrams=extractor.conn.execute("SELECT count(*), total(frequency) FROM ngrams").fetchone()
+    #closing checkpoints the WAL before the next measure
+    extractor.conn.close()
+    print(ngrams[0],int(ngrams[1]),elapsed,memory_status("VmHWM")-before)
+
+def run_child(mode,project):
+    output=subprocess.run([sys.executable,os.path.abspath(__file__),"--child",mode,project],check=True,capture_output=True,text=True).stdout.split()
+    return((int(output[0]),int(output[1])),float(output[2]),int(output[3])/1024)
+
+if __name__=="__main__":
+    if len(sys.argv)==4 and sys.argv[1]=="--child":
+        measure(sys.argv[2],sys.argv[3])
+        sys.exit(0)
+    sizes=[int(size) for size in sys.argv[1:]] or [50000,200000,800000]
+    from TBXTools import TBXTools
+    with tempfile.TemporaryDirectory() as workdir:
+        print("budget %d MB" % (BUDGET/1048576))
+        print("segments\tngrams>=2\texact RSS MB\texact s\texternal RSS MB\texternal s\tapriori RSS MB\tapriori s")
+        for size in sizes:
+            corpus=os.path.join(workdir,"corpus.txt")
+            project=os.path.join(workdir,"bench.sqlite")
+            synthetic_corpus(corpus,size)
+            extractor=TBXTools()
+            extractor.create_project(project,overwrite=True)
+            extractor.load_sl_corpus(corpus)
+            extractor.build_token_store("sl_corpus")
+            extractor.conn.close()
+            exact=run_child("exact",project)
+            external=run_child("external",project)
+            apriori=run_child("apriori",project)
+            if not exact[0]==external[0]==apriori[0]:
+                raise Exception("The ngrams of the modes differ")
+            print("%d\t%d\t%.0f\t%.2f\t%.0f\t%.2f\t%.0f\t%.2f" % (size,exact[0][0],exact[2],exact[1],external[2],external[1],apriori[2],apriori[1]))
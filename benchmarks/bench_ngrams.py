@@ -0,0 +1,75 @@
+#    TBXTools benchmark: ngram counting tokenizing every segment once per order into a FreqDist (the loop
+#    used before segment_ngrams) against tokenizing it once and counting sliding windows of every order
+#    over the same tokens into a Counter (the loop of ngram_calculation).
+#    Usage: python benchmarks/bench_ngrams.py [number_of_segments] [nmax]
+#    Both ways are measured with whitespace tokenization and with a tokenizer plugin, and must give the same counts.
+
+import os
+import sys
+import time
+import random
+import tempfile
+import collections
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from nltk.util import ngrams
+from nltk.probability import FreqDist
+from TBXTools import load_tokenizer, count_segment_ngrams
+
+#a tokenizer plugin splitting words and punctuation, like the tokenizers used with TBXTools
+PLUGIN='''import re
+class Tokenizer:
+    def tokenize(self,segment):
+        return(" ".join(re.findall(r"\\w+|[^\\w\\s]",segment)))
+    def detokenize(self,segment):
+        return(segment)
+'''
+
+def synthetic_segments(nsegments,seed=0):
+    rnd=random.Random(seed)
+    vocabulary=["w"+str(i) for i in range(20000)]+[",",".",";","(",")"]
+    segments=[]
+    for i in range(nsegments):
+        segments.append(" ".join(rnd.choice(vocabulary) for j in range(rnd.randint(5,30))))
+    return(segments)
+
+def count_per_order(segments,tokenize,nmin,nmax):
+    ngramsFD=FreqDist()
+    for segment in segments:
+        for n in range(nmin,nmax+1):
+            tokens=tokenize(segment)
+            for ng in ngrams(tokens,n):
+                ngramsFD[ng]+=1
+    return(ngramsFD)
+
+def count_once(segments,tokenize,nmin,nmax):
+    ngramsC=collections.Counter()
+    tokensC=collections.Counter()
+    for segment in segments:
+        count_segment_ngrams(tokenize(segment),1,nmin,nmax,ngramsC,tokensC)
+    return(ngramsC)
+
+def timed(function,segments,tokenize,nmin,nmax,repetitions=3):
+    times=[]
+    for r in range(repetitions):
+        start=time.perf_counter()
+        result=function(segments,tokenize,nmin,nmax)
+        times.append(time.perf_counter()-start)
+    return(min(times),result)
+
+if __name__=="__main__":
+    nsegments=int(sys.argv[1]) if len(sys.argv)>1 else 50000
+    nmax=int(sys.argv[2]) if len(sys.argv)>2 else 5
+    segments=synthetic_segments(nsegments)
+    with tempfile.TemporaryDirectory() as workdir:
+        plugin=os.path.join(workdir,"regex_tokenizer.py")
+        with open(plugin,"w",encoding="utf-8") as output:
+            output.write(PLUGIN)
+        print("tokenizer\tsegments\tnmax\ttokenize per order s\ttokenize once s\tspeedup")
+        for name,tokenizer in [("whitespace",""),("plugin",plugin)]:
+            tokenize=load_tokenizer(tokenizer)
+            before,expected=timed(count_per_order,segments,tokenize,1,nmax)
+            after,result=timed(count_once,segments,tokenize,1,nmax)
+            if not result.most_common()==expected.most_common():
+                raise Exception("The counts of both ways differ")
+            print("%s\t%d\t%d\t%.2f\t%.2f\t%.1fx" % (name,nsegments,nmax,before,after,before/after))
@@ -0,0 +1,82 @@
+#    TBXTools benchmark: peak memory of TMX loading for growing TMX files.
+#    Usage: python benchmarks/bench_tmx_memory.py [number_of_units ...]
+#    Every measure runs in a fresh process so its peak RSS is measured on its own:
+#    - legacy parser: iterparse without releasing the elements (the parser used before iter_tmx_pairs)
+#    - parser: iter_tmx_pairs alone
+#    - load: load_parallel_corpus_tmx into a project. The SQLite page cache is limited to 16 MB and
+#      mmap is disabled, as otherwise the cache of the performance profile (up to cache_size plus
+#      mmap_size) is also counted in the RSS.
+#    The peak RSS is given above the RSS of the process before parsing (the imported modules). It is read from
+#    /proc/self/status (Linux), as ru_maxrss would also count the RSS of the parent process when it was forked.
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import xml.etree.ElementTree as etree
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from bench_load import synthetic_tmx
+
+def legacy_tmx_pairs(tmx_file,slcodes,tlcodes):
+    sl_segment=""
+    tl_segment=""
+    current_lang=""
+    for event, elem in etree.iterparse(tmx_file,events=("start","end")):
+        if event=='start':
+            if elem.tag=="tu" and not sl_segment=="" and not tl_segment=="":
+                yield(sl_segment,tl_segment)
+                sl_segment=""
+                tl_segment=""
+            elif elem.tag=="tuv":
+                current_lang=elem.attrib['{http://www.w3.org/XML/1998/namespace}lang']
+            elif elem.tag=="seg":
+                if current_lang in slcodes:
+                    sl_segment=elem.text or ""
+                if current_lang in tlcodes:
+                    tl_segment=elem.text or ""
+
+def memory_status(field):
+    '''Returns a memory field of /proc/self/status in kilobytes.'''
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field+":"):
+                return(int(line.split()[1]))
+
+def measure(mode,tmx,project):
+    from TBXTools import TBXTools, iter_tmx_pairs
+    before=memory_status("VmRSS")
+    start=time.perf_counter()
+    if mode=="legacy":
+        units=sum(1 for pair in legacy_tmx_pairs(tmx,["en"],["es"]))
+    elif mode=="parser":
+        units=sum(1 for pair in iter_tmx_pairs(tmx,["en"],["es"]))
+    else:
+        extractor=TBXTools()
+        extractor.pragmas.update({"cache_size":-16384,"mmap_size":0})
+        extractor.create_project(project,overwrite=True)
+        extractor.load_parallel_corpus_tmx(tmx,sl_code="en",tl_code="es")
+        units=extractor.conn.execute("SELECT count(*) FROM parallel_corpus").fetchone()[0]
+    elapsed=time.perf_counter()-start
+    print(units,elapsed,memory_status("VmHWM")-before)
+
+def run_child(mode,tmx,project):
+    output=subprocess.run([sys.executable,os.path.abspath(__file__),"--child",mode,tmx,project],check=True,capture_output=True,text=True).stdout.split()
+    return(int(output[0]),float(output[1]),int(output[2])/1024)
+
+if __name__=="__main__":
+    if len(sys.argv)==5 and sys.argv[1]=="--child":
+        measure(sys.argv[2],sys.argv[3],sys.argv[4])
+        sys.exit(0)
+    sizes=[int(size) for size in sys.argv[1:]] or [25000,100000,400000]
+    with tempfile.TemporaryDirectory() as workdir:
+        print("units\tTMX MB\tlegacy parser RSS MB\tparser RSS MB\tload RSS MB\tload seconds")
+        for size in sizes:
+            tmx=os.path.join(workdir,"corpus.tmx")
+            project=os.path.join(workdir,"bench.sqlite")
+            synthetic_tmx(tmx,size)
+            legacy=run_child("legacy",tmx,project)
+            parser=run_child("parser",tmx,project)
+            load=run_child("load",tmx,project)
+            print("%d\t%.0f\t%.0f\t%.0f\t%.0f\t%.2f" % (load[0],os.path.getsize(tmx)/1048576,legacy[2],parser[2],load[2],load[1]))